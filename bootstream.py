@@ -13,9 +13,24 @@ Env vars (via systemd or shell):
 - MANIFEST_REFRESH_SEC: seconds between manifest refreshes (default 300)
 - HTTP_TIMEOUT_SEC: per-request timeout (default 6)
 - DEFAULT_VOLUME: 0–100; used if manifest omits `volume` (or set to empty to skip)
+- MANIFEST_CACHE_PATH: where the last manifest + ETag/Last-Modified are kept
+  (default /run/bootstream/manifest.json)
+- MPV_IPC_SOCKET: mpv JSON IPC socket used to switch streams without restarting
+  the player (default /run/bootstream/mpv.sock; empty disables)
+- BOOTSTREAM_QUIET: set to 1 to skip logging the full player command on each start
 """
-import json, os, sys, time, random, signal, subprocess, socket, shlex
-import urllib.request, urllib.error
+import json, os, sys, time, random, signal, subprocess, socket, shlex, select, fcntl, struct
+import http.client, urllib.parse
+
+try:
+    import orjson as _json  # faster manifest parsing when python3-orjson is installed
+except ImportError:
+    _json = json
+
+try:
+    import alsaaudio  # python3-alsaaudio: set mixer levels without spawning amixer
+except ImportError:
+    alsaaudio = None
 
 # ----------------- Configuration -----------------
 MANIFEST_URL = os.environ.get(
@@ -29,6 +44,9 @@ DEFAULT_VOL  = os.environ.get("DEFAULT_VOLUME", "")  # empty = don't touch volum
 REFRESH_SEC  = int(os.environ.get("MANIFEST_REFRESH_SEC", "300"))
 CONNECT_TIMEOUT = int(os.environ.get("HTTP_TIMEOUT_SEC", "6"))
 NETWORK_WAIT_TIMEOUT = int(os.environ.get("NETWORK_WAIT_TIMEOUT", "30"))
+MANIFEST_CACHE_PATH = os.environ.get("MANIFEST_CACHE_PATH", "/run/bootstream/manifest.json")
+MPV_IPC_SOCKET = os.environ.get("MPV_IPC_SOCKET", "/run/bootstream/mpv.sock")
+QUIET = os.environ.get("BOOTSTREAM_QUIET", "").lower() in ("1", "true", "yes", "on")
 
 # systemd watchdog
 WATCHDOG_USEC = int(os.environ.get("WATCHDOG_USEC", "0"))
@@ -37,64 +55,259 @@ NOTIFY_SOCKET = os.environ.get("NOTIFY_SOCKET")
 
 # --------------------------------------------------
 
-def sd_notify(msg: str):
-    if not NOTIFY_SOCKET:
-        return
+# Connected notify socket, reused for every heartbeat
+_NOTIFY_SOCK = None
+_MSG_READY = b"READY=1"
+_MSG_WATCHDOG = b"WATCHDOG=1"
+
+
+def _notify_connect():
+    global _NOTIFY_SOCK
     addr = NOTIFY_SOCKET
-    if addr and addr[0] == "@":
+    if addr[0] == "@":
         addr = "\0" + addr[1:]
     s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
     try:
         s.connect(addr)
-        s.sendall(msg.encode())
-    except Exception:
-        pass
-    finally:
+    except OSError:
         s.close()
+        raise
+    _NOTIFY_SOCK = s
+
+
+def sd_notify(msg):
+    global _NOTIFY_SOCK
+    if not NOTIFY_SOCKET:
+        return
+    if isinstance(msg, str):
+        msg = msg.encode()
+    try:
+        if _NOTIFY_SOCK is None:
+            _notify_connect()
+        _NOTIFY_SOCK.send(msg)
+    except OSError:
+        # systemd may have recreated the socket; reconnect once
+        if _NOTIFY_SOCK is not None:
+            _NOTIFY_SOCK.close()
+            _NOTIFY_SOCK = None
+        try:
+            _notify_connect()
+            _NOTIFY_SOCK.send(msg)
+        except OSError:
+            pass
+
+
+_JITTER = random.Random().uniform
 
 
 def jitter(base: float, pct: float = 0.2) -> float:
-    return base * (1 + (random.random() * 2 - 1) * pct)
+    return base * (1 + _JITTER(-pct, pct))
+
+
+# Last successfully fetched manifest, used for conditional (ETag / Last-Modified) refreshes
+MANIFEST_CACHE = {"url": None, "etag": None, "last_modified": None, "data": None}
+
+
+def load_manifest_cache():
+    """Restore the manifest cache written by a previous run, if any."""
+    try:
+        with open(MANIFEST_CACHE_PATH, "r") as f:
+            cached = json.load(f)
+        if isinstance(cached, dict) and isinstance(cached.get("data"), dict):
+            for key in MANIFEST_CACHE:
+                MANIFEST_CACHE[key] = cached.get(key)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[bootstream] Ignoring unreadable manifest cache: {e}", flush=True)
+
+
+def save_manifest_cache():
+    """Persist the manifest cache so a service restart can revalidate instead of re-download."""
+    try:
+        os.makedirs(os.path.dirname(MANIFEST_CACHE_PATH), exist_ok=True)
+        tmp_path = MANIFEST_CACHE_PATH + ".tmp"
+        # json.dumps runs the C encoder and hands the file one string; json.dump
+        # would walk the pure-Python iterencode and write chunk by chunk
+        data = json.dumps(MANIFEST_CACHE)
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, MANIFEST_CACHE_PATH)
+    except Exception as e:
+        print(f"[bootstream] Could not write manifest cache: {e}", flush=True)
+
+
+_STATIC_HEADERS = {"User-Agent": "bootstream/1.0"}
+
+# Kept-alive connection to the manifest host, reused across refreshes
+_HTTP_CONN = None
+_HTTP_CONN_KEY = None
+
+
+def _close_http_conn():
+    global _HTTP_CONN, _HTTP_CONN_KEY
+    if _HTTP_CONN is not None:
+        _HTTP_CONN.close()
+    _HTTP_CONN = None
+    _HTTP_CONN_KEY = None
+
+
+def http_get(url: str, headers: dict, max_redirects: int = 5):
+    """
+    GET a URL over a persistent connection, following redirects.
+    Returns (status, headers, body).
+    """
+    global _HTTP_CONN, _HTTP_CONN_KEY
+    for _ in range(max_redirects + 1):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {parts.scheme!r}")
+        key = (parts.scheme, parts.netloc)
+        if key != _HTTP_CONN_KEY:
+            # Different host: drop the old connection
+            _close_http_conn()
+            conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+            _HTTP_CONN = conn_cls(parts.hostname, parts.port, timeout=CONNECT_TIMEOUT)
+            _HTTP_CONN_KEY = key
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        for attempt in range(2):
+            reused = _HTTP_CONN.sock is not None
+            try:
+                _HTTP_CONN.request("GET", target, headers=headers)
+                r = _HTTP_CONN.getresponse()
+                body = r.read()
+                break
+            except (http.client.HTTPException, OSError):
+                _HTTP_CONN.close()
+                # The server may have dropped an idle keep-alive connection; retry once on a fresh one
+                if not reused or attempt:
+                    raise
+        if r.will_close:
+            _HTTP_CONN.close()
+
+        location = r.getheader("Location")
+        if r.status in (301, 302, 303, 307, 308) and location:
+            url = urllib.parse.urljoin(url, location)
+            continue
+        return r.status, r.headers, body
+    raise RuntimeError("Too many redirects")
 
 
 def fetch_manifest(url: str):
     if not url:
         raise RuntimeError("STREAM_MANIFEST_URL not set")
+    # Only revalidate when the cached copy belongs to this URL. The cache only
+    # changes on success (which returns), so the headers are fixed across retries.
+    cached = MANIFEST_CACHE["data"] if MANIFEST_CACHE["url"] == url else None
+    headers = _STATIC_HEADERS
+    if cached is not None:
+        headers = dict(_STATIC_HEADERS)
+        if MANIFEST_CACHE["etag"]:
+            headers["If-None-Match"] = MANIFEST_CACHE["etag"]
+        if MANIFEST_CACHE["last_modified"]:
+            headers["If-Modified-Since"] = MANIFEST_CACHE["last_modified"]
     delay = 2.0
     while True:
         try:
-            req = urllib.request.Request(url, headers={"User-Agent": "bootstream/1.0"})
-            with urllib.request.urlopen(req, timeout=CONNECT_TIMEOUT) as r:
-                return json.load(r)
+            status, resp_headers, body = http_get(url, headers)
+            if status == 304 and cached is not None:
+                # Not modified: reuse the parsed manifest from the cache
+                return cached
+            if status != 200:
+                raise RuntimeError(f"HTTP {status}")
+            manifest = _json.loads(body)
+            entry = {"url": url, "etag": resp_headers.get("ETag"),
+                     "last_modified": resp_headers.get("Last-Modified"), "data": manifest}
+            # Servers without validators answer 200 with the same manifest every
+            # time; skip re-encoding and rewriting the (tmpfs) cache file then
+            if entry != MANIFEST_CACHE:
+                MANIFEST_CACHE.update(entry)
+                save_manifest_cache()
+            return manifest
         except Exception as e:
             print(f"[bootstream] Manifest fetch failed: {e}", flush=True)
             time.sleep(min(jitter(delay), 30))
             delay = min(delay * 1.7, 30)
 
 
+MIXER_CONTROLS = ("PCM", "Headphone", "Speaker")
+_MIXERS = None
+
+
+def _get_mixers():
+    """Open the ALSA mixer controls that exist on this card, once."""
+    global _MIXERS
+    if _MIXERS is None:
+        available = alsaaudio.mixers()
+        _MIXERS = [alsaaudio.Mixer(ctl) for ctl in MIXER_CONTROLS if ctl in available]
+    return _MIXERS
+
+
 def set_volume(pct):
+    global _MIXERS
     if pct is None or pct == "":
         return
     try:
         v = max(0, min(100, int(pct)))
-        for ctl in ("PCM", "Headphone", "Speaker"):
+        if alsaaudio is not None:
+            try:
+                for mixer in _get_mixers():
+                    mixer.setvolume(v)
+                return
+            except alsaaudio.ALSAAudioError as e:
+                _MIXERS = None
+                print(f"[bootstream] ALSA mixer error ({e}); falling back to amixer", flush=True)
+        for ctl in MIXER_CONTROLS:
             subprocess.run(["amixer", "set", ctl, f"{v}%"], check=False,
                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     except Exception as e:
         print(f"[bootstream] Volume set failed: {e}", flush=True)
 
 
+# Player argv minus the stream URL; built once since the device never changes at runtime
+_MPV_PREFIX = (
+    "mpv", "--no-video", "--no-config",
+    "--ao=alsa", f"--audio-device={MPV_AUDIO_DEVICE}",
+    "--cache=yes", "--cache-secs=10",
+    # Start (and restart after a switch) only once a little audio is buffered,
+    # so a slow stream doesn't underrun the moment it begins
+    "--cache-pause-initial=yes",
+    "--network-timeout=20",
+) + ((f"--input-ipc-server={MPV_IPC_SOCKET}",) if MPV_IPC_SOCKET else ())
+
+
 def build_cmd(stream_url: str):
     """Build the player command. Default: mpv. Stable device naming."""
-    device = os.environ.get("MPV_AUDIO_DEVICE", MPV_AUDIO_DEVICE)
-    cmd = [
-        "mpv", "--no-video", "--no-config",
-        "--ao=alsa", f"--audio-device={device}",
-        "--cache=yes", "--cache-secs=10",
-        "--network-timeout=20",
-        stream_url,
-    ]
-    return cmd
+    return [*_MPV_PREFIX, stream_url]
+
+
+def mpv_loadfile(stream_url: str) -> bool:
+    """
+    Switch the running mpv to a new stream over its JSON IPC socket,
+    avoiding a full player restart. Returns True if mpv accepted it.
+    """
+    if not MPV_IPC_SOCKET:
+        return False
+    request = json.dumps({"command": ["loadfile", stream_url, "replace"], "request_id": 1})
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(2)
+    try:
+        s.connect(MPV_IPC_SOCKET)
+        s.sendall(request.encode() + b"\n")
+        # mpv interleaves event lines with the reply; wait for ours
+        with s.makefile("rb") as f:
+            for line in f:
+                reply = json.loads(line)
+                if reply.get("request_id") == 1:
+                    return reply.get("error") == "success"
+    except (OSError, ValueError) as e:
+        print(f"[bootstream] mpv IPC failed: {e}", flush=True)
+    finally:
+        s.close()
+    return False
 
 # If you insist on mpg123, comment build_cmd above and use this instead:
 # def build_cmd(stream_url: str):
@@ -130,45 +343,97 @@ signal.signal(signal.SIGTERM, handle_signal)
 signal.signal(signal.SIGINT, handle_signal)
 
 
+SIOCGIFADDR = 0x8915
+
+
+def has_ipv4_address():
+    """Check for an IPv4 address on any non-loopback interface (ioctl, no subprocess)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _, name in socket.if_nameindex():
+            if name == "lo":
+                continue
+            try:
+                fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", name[:15].encode()))
+                return True
+            except OSError:
+                # EADDRNOTAVAIL: interface has no IPv4 address
+                continue
+    except OSError:
+        pass
+    finally:
+        s.close()
+    return False
+
+
+RTMGRP_IPV4_IFADDR = 0x10
+
+
+def wait_for_ipv4_address(timeout: float) -> bool:
+    """
+    Wait until a non-loopback interface has an IPv4 address.
+    Sleeps on an rtnetlink subscription so a DHCP lease is noticed immediately.
+    """
+    try:
+        nl = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        nl.bind((0, RTMGRP_IPV4_IFADDR))
+        nl.setblocking(False)
+    except (AttributeError, OSError):
+        nl = None
+    try:
+        deadline = time.time() + timeout
+        while True:
+            # Probe first: the address may already be there
+            if has_ipv4_address():
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            if nl is None:
+                time.sleep(min(0.25, remaining))
+                continue
+            if select.select([nl], [], [], remaining)[0]:
+                try:
+                    while nl.recv(65536):
+                        pass
+                except BlockingIOError:
+                    pass
+    finally:
+        if nl is not None:
+            nl.close()
+
+
+_NM_MODULE = None
+
+
+def _get_network_manager():
+    """Load network-manager.py once (hyphenated name, so via importlib) and reuse it."""
+    global _NM_MODULE
+    if _NM_MODULE is None:
+        import importlib.util
+        network_manager_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "network-manager.py")
+        spec = importlib.util.spec_from_file_location("network_manager", network_manager_path)
+        network_manager = importlib.util.module_from_spec(spec)
+        try:
+            spec.loader.exec_module(network_manager)
+        except FileNotFoundError as e:
+            raise ImportError("network-manager.py not found") from e
+        _NM_MODULE = network_manager
+    return _NM_MODULE
+
+
 def wait_for_network_with_timeout(timeout=30):
     """
     Wait for network connectivity with timeout.
     Returns (has_ip, has_internet) tuple.
     """
     try:
-        # Try to import network-manager functions
-        sys.path.insert(0, os.path.dirname(__file__))
         try:
-            # Import using importlib to handle hyphenated module name
-            import importlib.util
-            network_manager_path = os.path.join(os.path.dirname(__file__), "network-manager.py")
-            if os.path.exists(network_manager_path):
-                spec = importlib.util.spec_from_file_location("network_manager", network_manager_path)
-                network_manager = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(network_manager)
-                return network_manager.wait_for_network(timeout=timeout, check_internet=False)
+            network_manager = _get_network_manager()
+            return network_manager.wait_for_network(timeout=timeout, check_internet=False)
         except ImportError:
-            # Fallback: simple IP check
-            import socket
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                try:
-                    # Try to get hostname (requires network)
-                    socket.gethostbyname("localhost")
-                    # Check for any IP on non-loopback interfaces
-                    import subprocess
-                    result = subprocess.run(
-                        ["ip", "-4", "addr", "show"],
-                        capture_output=True,
-                        text=True,
-                        timeout=2
-                    )
-                    if "inet " in result.stdout and "lo" not in result.stdout:
-                        return (True, False)  # Has IP, internet unknown
-                except Exception:
-                    pass
-                time.sleep(1)
-            return (False, False)
+            # Fallback: simple IP check, woken by rtnetlink address notifications
+            return (wait_for_ipv4_address(timeout), False)  # internet unknown
     except Exception as e:
         print(f"[bootstream] Network check error: {e}", flush=True)
         return (False, False)
@@ -193,6 +458,7 @@ def main():
     else:
         print(f"[bootstream] Network detected (IP: {has_ip}, Internet: {has_internet})", flush=True)
 
+    load_manifest_cache()
     manifest = fetch_manifest(MANIFEST_URL)
     stream_url = manifest.get("stream_url")
     if not stream_url:
@@ -205,14 +471,26 @@ def main():
 
     next_refresh = time.time() + REFRESH_SEC
 
-    sd_notify("READY=1")
+    sd_notify(_MSG_READY)
     if WATCHDOG_SEC:
-        sd_notify("WATCHDOG=1")
+        sd_notify(_MSG_WATCHDOG)
+
+    # Block in select() on a signal wakeup pipe instead of polling: SIGCHLD wakes us
+    # the moment the player dies, SIGTERM/SIGINT on shutdown, otherwise we sleep
+    # until the next watchdog/refresh deadline.
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda sig, frame: None)
+
+    child_started = 0.0
+    restart_at = 0.0
 
     while not stop_flag:
         now = time.time()
         if WATCHDOG_SEC and (now - last_watchdog) >= max(1.0, WATCHDOG_SEC / 2):
-            sd_notify("WATCHDOG=1")
+            sd_notify(_MSG_WATCHDOG)
             last_watchdog = now
 
         if now >= next_refresh:
@@ -224,27 +502,48 @@ def main():
                 if new_url != stream_url:
                     print("[bootstream] Stream URL changed; switching.", flush=True)
                     stream_url = new_url
-                    terminate_child()
+                    if child is not None and not mpv_loadfile(stream_url):
+                        # IPC unavailable: restart the player on the new URL
+                        terminate_child()
                 next_refresh = time.time() + REFRESH_SEC
             except Exception as e:
                 print(f"[bootstream] Manifest refresh error: {e}", flush=True)
                 next_refresh = time.time() + 30
 
-        if child is None or child.poll() is not None:
-            if child is not None:
-                code = child.poll()
-                print(f"[bootstream] Player exited code {code}; restarting soon.", flush=True)
+        if child is not None and child.poll() is not None:
+            code = child.poll()
+            print(f"[bootstream] Player exited code {code}; restarting soon.", flush=True)
+            child = None
+            # Don't respawn a player that keeps dying faster than once a second
+            restart_at = child_started + 1.0
+
+        if child is None and not stop_flag and time.time() >= restart_at:
             cmd = build_cmd(stream_url)
-            print(f"[bootstream] Starting: {' '.join(shlex.quote(c) for c in cmd)}", flush=True)
+            if not QUIET:
+                print(f"[bootstream] Starting: {shlex.join(cmd)}", flush=True)
             try:
                 child = subprocess.Popen(cmd)
+                child_started = time.time()
             except Exception as e:
                 print(f"[bootstream] Failed to start player: {e}", flush=True)
-                time.sleep(jitter(3.0))
-                continue
-
-        time.sleep(1)
+                restart_at = time.time() + jitter(3.0)
+
+        deadline = next_refresh
+        if WATCHDOG_SEC:
+            deadline = min(deadline, last_watchdog + max(1.0, WATCHDOG_SEC / 2))
+        if child is None:
+            deadline = min(deadline, restart_at)
+        if stop_flag:
+            break
+        ready, _, _ = select.select([wakeup_r], [], [], max(0.0, deadline - time.time()))
+        if ready:
+            try:
+                while os.read(wakeup_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
 
+    signal.set_wakeup_fd(-1)
     terminate_child()
     print("[bootstream] Exiting.", flush=True)
 
@@ -6,19 +6,51 @@ Serves configuration form and handles network configuration requests.
 import os
 import sys
 import json
+import gzip
+import hmac
+import math
+import base64
+import hashlib
+import importlib.util
+import http.client
 import http.server
-import socketserver
 import urllib.parse
-import urllib.request
-import urllib.error
 import subprocess
 import re
+import shlex
+import shutil
+import socket
 import time
+import signal
 import tempfile
+import threading
+import traceback
+import fcntl
+import struct
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import orjson as _json  # faster JSON parsing and encoding when python3-orjson is installed
+    _dumps = _json.dumps  # compact UTF-8 bytes, same as the fallback below
+except ImportError:
+    _json = json
+    
+    def _dumps(data):
+        return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+try:
+    import alsaaudio  # python3-alsaaudio: set mixer levels without spawning amixer
+except ImportError:
+    alsaaudio = None
+
 # Configuration
 CONFIG_SERVER_PORT = int(os.environ.get("CONFIG_SERVER_PORT", "8080"))
+# Processes accepting on the listening socket. Each one has its own caches
+# and its own failed-login throttle (AUTH_FAILURES), so N workers allow N
+# times the password guesses; the unit pins this to 1.
+CONFIG_SERVER_WORKERS = max(1, int(os.environ.get("CONFIG_SERVER_WORKERS", "1")))
 CONFIG_HTML_PATH = os.environ.get(
     "CONFIG_HTML_PATH",
     "/usr/local/share/bartix/templates/config.html"
@@ -28,42 +60,896 @@ NETWORK_CONFIG_SCRIPT = os.environ.get(
     "/usr/local/bin/network-config.py"
 )
 WEB_PASSWORD_FILE = "/etc/bartix/web_password.txt"
+# Settings changed from the UI are written as drop-ins under <unit>.d/ here
+SYSTEMD_UNIT_DIR = "/etc/systemd/system"
+
+# Read size when streaming journalctl output to /logs clients, and the
+# most journal lines a client may ask for
+LOG_CHUNK_SIZE = 65536
+MAX_LOG_LINES = 2000
+# Seconds a WiFi scan result is reused; a scan takes several seconds and the
+# configure page may ask for one repeatedly
+WIFI_SCAN_TTL = 15
+# Upper bound on query string fields; no route takes more than a few
+MAX_QUERY_FIELDS = 8
+# Largest POST body accepted; the UI only sends small JSON objects
+MAX_BODY_BYTES = 65536
+
+# Threads handling connections. Slow handlers (/scan-wifi, /configure) only
+# hold one each, while the Pi's memory stays bounded.
+REQUEST_THREADS = 8
+# Seconds an idle keep-alive connection may hold one of those threads
+KEEPALIVE_TIMEOUT = 5
+
+# Requests are handled concurrently; serialize the ones that reconfigure wlan0.
+# main() swaps in a process-shared lock when running several workers.
+WIFI_LOCK = threading.Lock()
+
+# Patterns used by the status and settings handlers, compiled once
+VOLUME_RE = re.compile(r'\[(\d+)%\]')
+AMIXER_SCONTROL_RE = re.compile(r"^Simple mixer control '([^']+)',\d+", re.MULTILINE)
+HOSTAPD_SSID_RE = re.compile(r'^ssid=(.*)$', re.MULTILINE)
+HOSTAPD_PASSPHRASE_RE = re.compile(r'^wpa_passphrase=.*$', re.MULTILINE)
+HOSTAPD_WPA_RE = re.compile(r'^wpa=.*$', re.MULTILINE)
+
+# Mixer controls set by /set-volume; the ALSA handles are opened lazily and
+# shared between handler threads under MIXER_LOCK
+MIXER_CONTROLS = ("PCM", "Headphone", "Speaker")
+MIXER_LOCK = threading.Lock()
+_MIXERS = None
+# Controls from MIXER_CONTROLS that `amixer scontrols` lists, detected once
+_AMIXER_CONTROLS = None
+
+# Idle keep-alive connections for /check-manifest, keyed by (scheme, netloc)
+HTTP_POOL = {}
+HTTP_POOL_LOCK = threading.Lock()
+HTTP_POOL_MAX_HOSTS = 4
+HTTP_POOL_MAX_PER_HOST = 4
+HTTP_TIMEOUT = 10
+# Largest manifest /check-manifest will download
+MAX_MANIFEST_BYTES = 1000000
+
+# `iw dev wlan0 scan` and `iwlist wlan0 scan` output, parsed in one pass each.
+# Only the fields the UI shows are matched; everything else is skipped.
+IW_SCAN_RE = re.compile(
+    rb'^BSS [0-9a-f:]{17}'
+    rb'|^\tSSID: (?P<ssid>[^\n]*)'
+    rb'|^\tsignal: (?P<signal>-?\d+(?:\.\d+)?)'
+    rb'|^\tfreq: (?P<freq>\d+(?:\.\d+)?)',
+    re.MULTILINE
+)
+IWLIST_SCAN_RE = re.compile(
+    rb'Cell \d+ - Address:'
+    rb'|ESSID:"(?P<ssid>[^\n]*)"'
+    rb'|Signal level=(?P<signal>-?\d+)(?![\d/])'
+)
+
+# Fixed error payloads, encoded once for the validation fast paths
+CANNED_ERRORS = {
+    key: json.dumps({"error": message}).encode('utf-8')
+    for key, message in (
+        ("invalid_json", "Invalid JSON"),
+        ("url_required", "URL is required"),
+        ("url_scheme", "URL must start with http:// or https://"),
+        ("volume_required", "Volume is required"),
+        ("ssid_required", "SSID is required"),
+        ("hotspot_password_short", "Password must be at least 8 characters"),
+        ("password_required", "Password is required"),
+        ("password_short", "Password must be at least 4 characters"),
+        ("body_too_large", "Request body too large"),
+        ("bad_content_length", "Invalid Content-Length"),
+    )
+}
+
+# Configuration form, loaded at startup by load_config_html() and reloaded
+# by refresh_config_html() when the file on disk changes. The body, its gzip
+# copy and ETag are swapped as one tuple so a reload never mixes versions.
+CACHED_FORM = None  # (html, html_gz, etag)
+CACHED_HTML_PATH = None
+CACHED_HTML_MTIME = None
+HTML_LOCK = threading.Lock()
+
+
+def load_config_html():
+    """Read the configuration form into memory, gzip it and compute its ETag."""
+    global CACHED_FORM, CACHED_HTML_PATH, CACHED_HTML_MTIME
+    # Try installed location first, then fallback to local
+    html_paths = [
+        CONFIG_HTML_PATH,
+        os.path.join(os.path.dirname(__file__), "templates", "config.html"),
+        "templates/config.html"
+    ]
+    for path in html_paths:
+        try:
+            with open(path, 'rb') as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                html = f.read()
+        except OSError:
+            continue
+        etag = '"' + hashlib.sha1(html).hexdigest() + '"'
+        CACHED_FORM = (html, gzip.compress(html, compresslevel=6), etag)
+        CACHED_HTML_PATH = path
+        CACHED_HTML_MTIME = mtime
+        print(f"[config-server] Loaded configuration form from {path}", flush=True)
+        return True
+    print("[config-server] Warning: configuration form not found", flush=True)
+    return False
+
+
+def refresh_config_html():
+    """Reload the configuration form if the cached copy is missing or stale.
+    
+    Costs one stat() per request, so an updated template is picked up
+    without restarting the server.
+    """
+    if _config_html_current():
+        return
+    with HTML_LOCK:
+        # Another request may have reloaded it while this one waited
+        if not _config_html_current():
+            load_config_html()
+
+
+def _config_html_current():
+    """True unless the cached form is missing or its file's mtime has changed."""
+    if CACHED_HTML_PATH is None:
+        return False
+    try:
+        return os.stat(CACHED_HTML_PATH).st_mtime_ns == CACHED_HTML_MTIME
+    except OSError:
+        # Mid-update or removed: keep serving the last good copy
+        return True
+
+
+def set_mixer_volume(volume):
+    """Set every available mixer control to volume percent."""
+    global _MIXERS, _AMIXER_CONTROLS
+    if alsaaudio is not None:
+        with MIXER_LOCK:
+            try:
+                if _MIXERS is None:
+                    available = alsaaudio.mixers()
+                    _MIXERS = [alsaaudio.Mixer(ctl) for ctl in MIXER_CONTROLS if ctl in available]
+                for mixer in _MIXERS:
+                    mixer.setvolume(volume)
+                return
+            except alsaaudio.ALSAAudioError as e:
+                _MIXERS = None
+                print(f"[config-server] ALSA mixer error ({e}); falling back to amixer", flush=True)
+    controls = _AMIXER_CONTROLS
+    if controls is None:
+        result = subprocess.run(["amixer", "scontrols"], capture_output=True, text=True, check=False)
+        available = set(AMIXER_SCONTROL_RE.findall(result.stdout))
+        controls = [ctl for ctl in MIXER_CONTROLS if ctl in available]
+        if controls:
+            _AMIXER_CONTROLS = controls
+        else:
+            # Couldn't tell (no card yet?); try them all and detect again next time
+            controls = MIXER_CONTROLS
+    # One amixer process for all controls, commands fed on stdin
+    commands = "".join(f"sset {ctl} {volume}%\n" for ctl in controls)
+    subprocess.run(["amixer", "-q", "-s"], input=commands, text=True, check=False,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def write_file_atomic(path, content, mode=None):
+    """
+    Replace a text file via a temporary file and rename, keeping its mode
+    unless one is given, so a crash or power loss never leaves it half-written.
+    Returns False, without writing, if the file already has this content and mode.
+    """
+    directory = os.path.dirname(path) or "."
+    try:
+        with open(path, 'r') as f:
+            current_mode = os.fstat(f.fileno()).st_mode & 0o7777
+            current = f.read()
+    except FileNotFoundError:
+        current_mode = current = None
+    if mode is None:
+        mode = 0o644 if current_mode is None else current_mode
+    if current == content and current_mode == mode:
+        return False
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+def write_unit_environment(unit, name, env, mode=0o644):
+    """
+    Set Environment= variables for a systemd unit through a drop-in
+    (<unit>.d/<name>), leaving the installed unit file untouched.
+    Returns whether the drop-in changed; if so the caller runs daemon-reload.
+    """
+    lines = ["[Service]"]
+    for key, value in env.items():
+        if "\n" in value or "\r" in value:
+            raise ValueError(f"{key} must not contain line breaks")
+        # Quoted so values may contain spaces; % would start a unit specifier
+        assignment = f"{key}={value}".replace("\\", "\\\\").replace('"', '\\"').replace("%", "%%")
+        lines.append(f'Environment="{assignment}"')
+    dropin_dir = os.path.join(SYSTEMD_UNIT_DIR, f"{unit}.d")
+    os.makedirs(dropin_dir, exist_ok=True)
+    return write_file_atomic(os.path.join(dropin_dir, name), "\n".join(lines) + "\n", mode)
+
+
+# /configure request schemas: required fields, optional fields with defaults,
+# and the network-config.py flag each field maps to
+CONFIGURE_SCHEMAS = {
+    "wifi": {
+        "required": ("wifi_ssid",),
+        "optional": {"wifi_password": ""},
+        "argmap": {"wifi_ssid": "--ssid", "wifi_password": "--password"},
+        "error": "WiFi SSID is required",
+    },
+    "lan_static": {
+        "required": ("lan_ip", "lan_subnet", "lan_gateway"),
+        "optional": {"lan_dns": "8.8.8.8"},
+        "argmap": {"lan_ip": "--ip", "lan_subnet": "--subnet", "lan_gateway": "--gateway", "lan_dns": "--dns"},
+        "error": "IP, subnet, and gateway are required for LAN static IP, or use DHCP",
+    },
+    "lan_dhcp": {
+        "required": (),
+        "optional": {},
+        "argmap": {},
+        "flags": ("--dhcp",),
+    },
+}
+
+
+def build_configure_args(data):
+    """
+    Validate a /configure request body against CONFIGURE_SCHEMAS.
+    Returns (True, network-config.py arguments) or (False, error message).
+    """
+    network_type = data.get('network_type')
+    if not network_type:
+        return False, "Network type is required"
+    
+    schema_name = network_type
+    if network_type == "lan":
+        # Check if DHCP is requested
+        lan_dhcp = data.get('lan_dhcp', False)
+        if isinstance(lan_dhcp, str):
+            lan_dhcp = lan_dhcp.lower() in ('true', '1', 'yes', 'on')
+        schema_name = "lan_dhcp" if lan_dhcp else "lan_static"
+    
+    schema = CONFIGURE_SCHEMAS.get(schema_name)
+    if schema is None:
+        return False, "Invalid network type"
+    if not all(data.get(field) for field in schema["required"]):
+        return False, schema["error"]
+    
+    args = ["--network-type", network_type, *schema.get("flags", ())]
+    for field, flag in schema["argmap"].items():
+        value = data.get(field) or schema["optional"].get(field)
+        if value:
+            args.extend([flag, str(value)])
+    return True, args
+
+
+def _pool_take(key):
+    """Take an idle connection for key out of HTTP_POOL, or open a new one."""
+    with HTTP_POOL_LOCK:
+        idle = HTTP_POOL.get(key)
+        if idle:
+            return idle.pop()
+    scheme, netloc = key
+    conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    return conn_cls(netloc, timeout=HTTP_TIMEOUT)
+
+
+def _pool_return(key, conn):
+    """Put a still-open connection back into HTTP_POOL, closing it if the pool is full."""
+    evicted = []
+    with HTTP_POOL_LOCK:
+        idle = HTTP_POOL.get(key)
+        if idle is None:
+            if len(HTTP_POOL) >= HTTP_POOL_MAX_HOSTS:
+                # Drop the least recently added host
+                evicted = HTTP_POOL.pop(next(iter(HTTP_POOL)))
+            idle = HTTP_POOL[key] = []
+        if len(idle) < HTTP_POOL_MAX_PER_HOST:
+            idle.append(conn)
+            conn = None
+    for c in evicted:
+        c.close()
+    if conn is not None:
+        conn.close()
+
+
+def pooled_get(url, headers, max_redirects=5, max_bytes=MAX_MANIFEST_BYTES):
+    """
+    GET a URL over a pooled keep-alive connection, following redirects.
+    Returns (status, reason, body). Raises ValueError for bodies over max_bytes.
+    """
+    for _ in range(max_redirects + 1):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {parts.scheme!r}")
+        key = (parts.scheme, parts.netloc)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        
+        conn = _pool_take(key)
+        for attempt in range(2):
+            reused = conn.sock is not None
+            try:
+                conn.request("GET", target, headers=headers)
+                response = conn.getresponse()
+                if response.length is not None and response.length > max_bytes:
+                    conn.close()
+                    raise ValueError(f"Response larger than {max_bytes} bytes")
+                # Bounded read: a wrong URL may point at an endless audio stream
+                body = response.read(max_bytes + 1)
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                # An idle pooled connection may have been dropped by the server; retry once
+                if not reused or attempt:
+                    raise
+        if len(body) > max_bytes:
+            conn.close()
+            raise ValueError(f"Response larger than {max_bytes} bytes")
+        if response.will_close or not response.isclosed():
+            conn.close()
+        else:
+            _pool_return(key, conn)
+        
+        location = response.getheader("Location")
+        if response.status in (301, 302, 303, 307, 308) and location:
+            url = urllib.parse.urljoin(url, location)
+            continue
+        return response.status, response.reason, body
+    raise RuntimeError("Too many redirects")
+
+
+# Stored web password hash, re-read only when the file changes. Key is
+# (mtime, size, inode), so an atomic replace is noticed too. "verified" is
+# an HMAC (under a per-process key) of the last password that matched, so
+# the browser's repeated requests don't each pay for PBKDF2.
+_PASSWORD_CACHE = {"key": None, "value": None, "verified": None}
+PASSWORD_LOCK = threading.Lock()
+_PROCESS_KEY = os.urandom(32)
+
+# Stored as pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>. Verifying takes
+# a fraction of a second on a Pi, and only the first request with a given
+# password pays for it.
+PASSWORD_HASH_PREFIX = "pbkdf2_sha256"
+PASSWORD_HASH_ITERATIONS = 100000
+
+
+def hash_web_password(password):
+    """Return the salted PBKDF2 hash of password (str) to store in WEB_PASSWORD_FILE."""
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode('utf-8'), salt, PASSWORD_HASH_ITERATIONS)
+    return f"{PASSWORD_HASH_PREFIX}${PASSWORD_HASH_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+def load_web_password():
+    """
+    Return the stored web password hash as bytes, or None if none is set.
+    Costs one stat() when the file hasn't changed since the last call.
+    """
+    try:
+        st = os.stat(WEB_PASSWORD_FILE)
+    except FileNotFoundError:
+        return None
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with PASSWORD_LOCK:
+        if _PASSWORD_CACHE["key"] != key:
+            with open(WEB_PASSWORD_FILE, 'rb') as f:
+                _PASSWORD_CACHE["value"] = f.read().strip()
+            _PASSWORD_CACHE["key"] = key
+            _PASSWORD_CACHE["verified"] = None
+        return _PASSWORD_CACHE["value"]
+
+
+def verify_web_password(password, stored):
+    """Return whether password (bytes) matches stored, as returned by load_web_password()."""
+    tag = hmac.new(_PROCESS_KEY, password, hashlib.sha256).digest()
+    with PASSWORD_LOCK:
+        verified = _PASSWORD_CACHE["verified"] if _PASSWORD_CACHE["value"] is stored else None
+    if verified is not None and hmac.compare_digest(tag, verified):
+        return True
+    
+    if stored.startswith(PASSWORD_HASH_PREFIX.encode() + b"$"):
+        try:
+            _, iterations, salt, expected = stored.split(b"$")
+            digest = hashlib.pbkdf2_hmac("sha256", password, bytes.fromhex(salt.decode()), int(iterations))
+            matches = hmac.compare_digest(digest, bytes.fromhex(expected.decode()))
+        except ValueError:
+            matches = False
+    else:
+        # Plaintext from before passwords were hashed; replaced by the next /set-password
+        matches = hmac.compare_digest(password, stored)
+    
+    if matches:
+        with PASSWORD_LOCK:
+            if _PASSWORD_CACHE["value"] is stored:
+                _PASSWORD_CACHE["verified"] = tag
+    return matches
+
+
+# Wrong passwords per client address: address -> (count, monotonic time of
+# the last one, monotonic time until which it is throttled). Past
+# AUTH_FREE_FAILURES within AUTH_FAILURE_WINDOW seconds, each further failure
+# throttles the address for a doubling period of at most AUTH_MAX_DELAY.
+# Throttled requests get an immediate 429 without the password being checked,
+# so guessing by brute force is impractical and no worker thread is parked.
+# The table is per process; see CONFIG_SERVER_WORKERS.
+AUTH_FAILURES = {}
+AUTH_FAILURES_LOCK = threading.Lock()
+AUTH_FAILURE_WINDOW = 10
+AUTH_FREE_FAILURES = 5
+AUTH_MAX_DELAY = 2.0
+
+
+def record_auth_failure(address):
+    """Count a wrong password from address, throttling it past AUTH_FREE_FAILURES."""
+    now = time.monotonic()
+    with AUTH_FAILURES_LOCK:
+        count, last, _ = AUTH_FAILURES.get(address, (0, now, now))
+        if now - last > AUTH_FAILURE_WINDOW:
+            count = 0
+        count += 1
+        delay = 0
+        if count > AUTH_FREE_FAILURES:
+            delay = min(0.5 * 2 ** (count - AUTH_FREE_FAILURES - 1), AUTH_MAX_DELAY)
+        AUTH_FAILURES[address] = (count, now, now + delay)
+        if len(AUTH_FAILURES) > 256:
+            # Forget addresses that have been quiet for a whole window
+            for key, (_, seen, _) in list(AUTH_FAILURES.items()):
+                if now - seen > AUTH_FAILURE_WINDOW:
+                    del AUTH_FAILURES[key]
+
+
+def auth_retry_after(address):
+    """Return how many seconds address is still throttled for (0 if it isn't)."""
+    entry = AUTH_FAILURES.get(address)
+    if entry is None:
+        return 0
+    return max(0, entry[2] - time.monotonic())
+
+
+def wait_until(predicate, timeout, interval=0.2):
+    """
+    Call predicate every interval seconds until it returns something true or
+    timeout seconds have passed, and return its last result.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if result or time.monotonic() >= deadline:
+            return result
+        time.sleep(interval)
+
+
+def interface_is_up(interface):
+    """Return whether the kernel reports interface as administratively up (IFF_UP)."""
+    try:
+        with open(f"/sys/class/net/{interface}/flags", 'r') as f:
+            return bool(int(f.read(), 16) & 0x1)
+    except (OSError, ValueError):
+        return False
+
+
+SIOCGIFADDR = 0x8915
+
+
+def interface_has_ipv4(interface):
+    """Return whether interface has an IPv4 address (ioctl, no subprocess)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", interface[:15].encode()))
+        return True
+    except OSError:
+        # EADDRNOTAVAIL: no IPv4 address; ENODEV: no such interface
+        return False
+    finally:
+        s.close()
+
+
+def wait_for_interface_up(interface, timeout=2.0, interval=0.05):
+    """
+    Wait until the kernel reports interface as administratively up (IFF_UP).
+    Returns True as soon as it is, False if timeout runs out first.
+    """
+    return wait_until(lambda: interface_is_up(interface), timeout, interval)
+
+
+def _keep_strongest(networks, network):
+    """Add a parsed network to networks (by SSID) unless a stronger one is already there."""
+    ssid = network.get("ssid")
+    if not ssid:
+        return
+    previous = networks.get(ssid)
+    if previous is None or network.get("signal", -999) > previous.get("signal", -999):
+        networks[ssid] = network
+
+
+def parse_iw_scan(output):
+    """Parse `iw dev <if> scan` output (bytes) into {ssid: network}, strongest BSS per SSID."""
+    networks = {}
+    current = {}
+    for match in IW_SCAN_RE.finditer(output):
+        ssid, signal, freq = match.group('ssid', 'signal', 'freq')
+        if ssid is not None:
+            if ssid.strip():
+                current["ssid"] = ssid.strip().decode('utf-8', 'replace')
+        elif signal is not None:
+            current["signal"] = int(float(signal))
+        elif freq is not None:
+            current["frequency"] = freq.decode('ascii')
+        else:
+            # Start of the next BSS
+            _keep_strongest(networks, current)
+            current = {}
+    _keep_strongest(networks, current)
+    return networks
+
+
+def parse_iwlist_scan(output):
+    """Parse `iwlist <if> scan` output (bytes) into {ssid: network}, strongest cell per SSID."""
+    networks = {}
+    current = {}
+    for match in IWLIST_SCAN_RE.finditer(output):
+        ssid, signal = match.group('ssid', 'signal')
+        if ssid is not None:
+            if ssid:
+                current["ssid"] = ssid.decode('utf-8', 'replace')
+        elif signal is not None:
+            # iwlist uses negative dBm; a positive value is probably another scale
+            current["signal"] = -abs(int(signal))
+        else:
+            # Start of the next cell
+            _keep_strongest(networks, current)
+            current = {}
+    _keep_strongest(networks, current)
+    return networks
+
+
+class ScanError(Exception):
+    """Neither iw nor iwlist could scan; the message is their error output."""
+
+
+def scan_wifi():
+    """
+    Scan wlan0 for networks with iw, falling back to iwlist.
+    Returns one entry per SSID, strongest signal first; raises ScanError.
+    """
+    with WIFI_LOCK:
+        # With AP+STA concurrent support, wlan0 (for scanning) and wlan0_ap (for hotspot) are separate
+        # No need to stop hostapd - scanning on wlan0 doesn't interfere with hotspot on wlan0_ap
+        
+        # An rfkill block takes the interface down, so an up wlan0 needs neither
+        # rfkill nor ip; only spawn them when it is down
+        if not interface_is_up("wlan0"):
+            # Unblock WiFi (rfkill returns once the block is lifted)
+            subprocess.run(
+                ["rfkill", "unblock", "wifi"],
+                check=False,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            
+            # Bring interface up, then scan as soon as the kernel reports it up
+            subprocess.run(
+                ["ip", "link", "set", "wlan0", "up"],
+                check=False,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            wait_for_interface_up("wlan0")
+        
+        # Scan for networks using iw (preferred)
+        # Output stays bytes; only the matched SSIDs are decoded
+        result = subprocess.run(
+            ["iw", "dev", "wlan0", "scan"],
+            capture_output=True,
+            timeout=20
+        )
+        
+        networks = {}
+        scan_success = False
+        
+        if result.returncode == 0:
+            networks = parse_iw_scan(result.stdout)
+            scan_success = True
+        
+        # Try iwlist if iw failed or found no networks
+        if not scan_success or not networks:
+            result = subprocess.run(
+                ["iwlist", "wlan0", "scan"],
+                capture_output=True,
+                timeout=20
+            )
+            
+            if result.returncode == 0:
+                networks = parse_iwlist_scan(result.stdout)
+                scan_success = True
+        
+        if not scan_success:
+            raise ScanError(result.stderr.decode('utf-8', 'replace') or 'Unknown error')
+        
+        # Already one entry per SSID; sort by signal strength (higher is better)
+        return sorted(networks.values(), key=lambda x: x.get("signal", -100), reverse=True)
+
+
+_NETWORK_CONFIG_SCRIPT_PATH = None
+
+
+def find_network_config_script():
+    """
+    Return the path of network-config.py: the installed one, else the copy
+    next to this file. Remembered once found; None if neither exists.
+    """
+    global _NETWORK_CONFIG_SCRIPT_PATH
+    if _NETWORK_CONFIG_SCRIPT_PATH is None:
+        local_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "network-config.py")
+        for path in (NETWORK_CONFIG_SCRIPT, local_script):
+            if os.path.isfile(path):
+                _NETWORK_CONFIG_SCRIPT_PATH = path
+                break
+    return _NETWORK_CONFIG_SCRIPT_PATH
+
+
+# network-manager.py, loaded once at startup by load_network_manager();
+# None if it could not be loaded
+_NM_MODULE = None
+
+
+def load_network_manager():
+    """Load network-manager.py (hyphenated name, so via importlib) for /status."""
+    global _NM_MODULE
+    network_manager_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "network-manager.py")
+    try:
+        spec = importlib.util.spec_from_file_location("network_manager", network_manager_path)
+        network_manager = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(network_manager)
+    except Exception as e:
+        print(f"[config-server] Warning: network-manager.py not available: {e}", flush=True)
+        return False
+    _NM_MODULE = network_manager
+    return True
+
+
+# network-config.py, loaded once at startup by load_network_config() so
+# /configure and /clear-wifi can call it without starting another
+# interpreter; None if it could not be loaded
+_NETCFG_MODULE = None
+
+
+def load_network_config():
+    """Load network-config.py (hyphenated name, so via importlib) for /configure and /clear-wifi."""
+    global _NETCFG_MODULE
+    script_path = find_network_config_script()
+    if script_path is None:
+        print("[config-server] Warning: network-config.py not found", flush=True)
+        return False
+    try:
+        spec = importlib.util.spec_from_file_location("network_config", script_path)
+        network_config = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(network_config)
+    except Exception as e:
+        print(f"[config-server] Warning: network-config.py not available: {e}", flush=True)
+        return False
+    _NETCFG_MODULE = network_config
+    return True
+
+
+# Runs the independent /status probes side by side
+STATUS_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="status")
+
+# /status probe results (and the last WiFi scan): key -> (expiry on the
+# monotonic clock, value). The UI polls /status every few seconds; the
+# handlers that change a value drop its entry so the next poll sees the new one.
+_STATUS_CACHE = {}
+# Probes currently running: key -> Event set when the result is cached.
+# Concurrent pollers wait for the one in flight instead of forking their own.
+_STATUS_INFLIGHT = {}
+_STATUS_LOCK = threading.Lock()
+
+
+def _cached(key, ttl, fn):
+    """Return fn() from _STATUS_CACHE, calling it only when the entry has expired."""
+    while True:
+        with _STATUS_LOCK:
+            entry = _STATUS_CACHE.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            event = _STATUS_INFLIGHT.get(key)
+            if event is None:
+                event = _STATUS_INFLIGHT[key] = threading.Event()
+                break
+        # Another thread is probing; use its result (or take over if it failed)
+        event.wait()
+    try:
+        value = fn()
+        with _STATUS_LOCK:
+            _STATUS_CACHE[key] = (time.monotonic() + ttl, value)
+        return value
+    finally:
+        with _STATUS_LOCK:
+            del _STATUS_INFLIGHT[key]
+        event.set()
+
+
+def _get_connectivity():
+    """Return (has_ip, has_internet) from network-manager.py, or (False, False)."""
+    if _NM_MODULE is not None:
+        try:
+            return _NM_MODULE.has_network_connectivity()
+        except Exception:
+            pass
+    return False, False
+
+
+def _get_hotspot_running():
+    """Return whether the hotspot is up according to network-manager.py."""
+    if _NM_MODULE is not None:
+        try:
+            return _NM_MODULE.is_hotspot_running()
+        except Exception:
+            pass
+    return False
+
+
+def _get_manifest_url():
+    """Read STREAM_MANIFEST_URL from the stream-player service environment."""
+    try:
+        result = subprocess.run(
+            ["systemctl", "show", "stream-player.service", "--property=Environment", "--value"],
+            capture_output=True,
+            text=True,
+            check=False
+        )
+        # systemd quotes assignments containing spaces, so split it like a shell would
+        for token in shlex.split(result.stdout):
+            if token.startswith("STREAM_MANIFEST_URL="):
+                return token.split("=", 1)[1]
+    except Exception:
+        pass
+    return ""
+
+
+def _get_volume():
+    """Read the current PCM volume percentage from amixer, or None."""
+    try:
+        result = subprocess.run(
+            ["amixer", "get", "PCM"],
+            capture_output=True,
+            text=True,
+            check=False
+        )
+        # The first [NN%] in the output is the first channel's volume
+        match = VOLUME_RE.search(result.stdout)
+        if match:
+            return int(match.group(1))
+    except Exception:
+        pass
+    return None
+
+
+def _get_hotspot_ssid():
+    """Read the hotspot SSID from the hostapd config."""
+    try:
+        with open("/etc/hostapd/hostapd.conf", 'r') as f:
+            match = HOSTAPD_SSID_RE.search(f.read())
+        if match:
+            return match.group(1).strip()
+    except Exception:
+        pass
+    return ""
 
 
 class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     """HTTP request handler for configuration server."""
     
+    # Buffer the response so the header block and a small body go out in one
+    # send; handle_one_request() flushes after every request
+    wbufsize = 64 * 1024
+    # Keep connections open between the page's polls; every response carries
+    # a Content-Length (or closes the connection) so the client knows where it ends
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    
+    def setup(self):
+        """Disable Nagle so short JSON replies aren't held back waiting for an ACK."""
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    
     def check_auth(self):
         """Check if request is authenticated."""
-        # Check if password file exists
-        if not os.path.exists(WEB_PASSWORD_FILE):
+        try:
+            stored_password = load_web_password()
+        except OSError:
+            return False
+        if stored_password is None:
             return True  # No password set, allow access
         
+        password = None
         auth_header = self.headers.get('Authorization', '')
-        if not auth_header.startswith('Basic '):
-            return False
+        if auth_header.startswith('Basic '):
+            try:
+                decoded = base64.b64decode(auth_header[6:].strip())
+                password = decoded.split(b':', 1)[1]
+            except (ValueError, IndexError):
+                pass
+        if password is None:
+            return False  # No credentials yet; not a guess
         
-        import base64
-        try:
-            encoded = auth_header.split(' ', 1)[1]
-            decoded = base64.b64decode(encoded).decode('utf-8')
-            username, password = decoded.split(':', 1)
-            
-            # Read stored password
-            with open(WEB_PASSWORD_FILE, 'r') as f:
-                stored_password = f.read().strip()
-            
-            return password == stored_password
-        except Exception:
+        client = self.client_address[0]
+        if auth_retry_after(client):
+            return False  # Throttled: require_auth() answers 429 without checking
+        
+        # Salted hash compared in constant time, so response timing doesn't
+        # reveal how much of the password matched
+        matches = verify_web_password(password, stored_password)
+        if not matches:
+            record_auth_failure(client)
             return False
+        if client in AUTH_FAILURES:
+            with AUTH_FAILURES_LOCK:
+                AUTH_FAILURES.pop(client, None)
+        return True
     
     def require_auth(self):
-        """Send 401 authentication required."""
-        self.send_response(401)
-        self.send_header('WWW-Authenticate', 'Basic realm="Bartix Configuration"')
+        """Send 401 authentication required, or 429 while the client is throttled."""
+        retry_after = auth_retry_after(self.client_address[0])
+        if retry_after:
+            body = b'Too many failed attempts'
+            self.send_response(429)
+            self.send_header('Retry-After', str(math.ceil(retry_after)))
+        else:
+            body = b'Authentication required'
+            self.send_response(401)
+            self.send_header('WWW-Authenticate', 'Basic realm="Bartix Configuration"')
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        if self.command == 'POST':
+            # The body goes unread; don't parse it as the next request
+            self.send_header('Connection', 'close')
+            self.close_connection = True
         self.end_headers()
-        self.wfile.write(b'Authentication required')
+        self.wfile.write(body)
+    
+    # Path -> handler method name. Looked up once per request instead of
+    # walking an if/elif chain; handlers that take parameters parse
+    # self.query with parse_query().
+    GET_ROUTES = {
+        "/": "serve_config_form",
+        "/status": "serve_status",
+        "/logs": "route_logs",
+        "/check-manifest": "route_check_manifest",
+        "/scan-wifi": "route_scan_wifi",
+        "/clear-wifi": "clear_wifi_credentials",
+        "/test-wifi": "route_test_wifi",
+        "/check-auth": "route_check_auth",
+    }
+    POST_ROUTES = {
+        "/configure": "handle_configure",
+        "/update-manifest": "handle_update_manifest",
+        "/set-volume": "handle_set_volume",
+        "/reboot": "handle_reboot",
+        "/update-hotspot": "handle_update_hotspot",
+        "/set-password": "handle_set_password",
+        "/clear-wifi": "clear_wifi_credentials",
+    }
+    # POST routes whose handlers never read a request body
+    POST_WITHOUT_BODY = frozenset({"/reboot", "/clear-wifi"})
     
     def do_GET(self):
         """Handle GET requests."""
@@ -73,33 +959,12 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
             self.require_auth()
             return
         
-        query_params = urllib.parse.parse_qs(parsed_path.query)
-        
-        if parsed_path.path == "/":
-            self.serve_config_form()
-        elif parsed_path.path == "/status":
-            self.serve_status()
-        elif parsed_path.path == "/logs":
-            service = query_params.get('service', ['network-manager'])[0]
-            lines = int(query_params.get('lines', ['100'])[0])
-            self.serve_logs(service, lines)
-        elif parsed_path.path == "/check-manifest":
-            url = query_params.get('url', [''])[0]
-            self.check_manifest(url)
-        elif parsed_path.path == "/scan-wifi":
-            self.scan_wifi_networks()
-        elif parsed_path.path == "/clear-wifi":
-            self.clear_wifi_credentials()
-        elif parsed_path.path == "/test-wifi":
-            ssid = query_params.get('ssid', [''])[0]
-            password = query_params.get('password', [''])[0]
-            self.test_wifi_connection(ssid, password)
-        elif parsed_path.path == "/check-auth":
-            # Endpoint to check if password is set
-            has_password = os.path.exists(WEB_PASSWORD_FILE)
-            self.send_json_response(200, {"has_password": has_password})
-        else:
+        handler = self.GET_ROUTES.get(parsed_path.path)
+        if handler is None:
             self.send_error(404, "Not Found")
+            return
+        self.query = parsed_path.query
+        getattr(self, handler)()
     
     def do_POST(self):
         """Handle POST requests."""
@@ -110,126 +975,139 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
             self.require_auth()
             return
         
-        if parsed_path.path == "/configure":
-            self.handle_configure()
-        elif parsed_path.path == "/update-manifest":
-            self.handle_update_manifest()
-        elif parsed_path.path == "/set-volume":
-            self.handle_set_volume()
-        elif parsed_path.path == "/reboot":
-            self.handle_reboot()
-        elif parsed_path.path == "/update-hotspot":
-            self.handle_update_hotspot()
-        elif parsed_path.path == "/set-password":
-            self.handle_set_password()
-        elif parsed_path.path == "/clear-wifi":
-            self.clear_wifi_credentials()
-        else:
+        handler = self.POST_ROUTES.get(parsed_path.path)
+        if handler is None:
             self.send_error(404, "Not Found")
+            return
+        if parsed_path.path in self.POST_WITHOUT_BODY and self.headers.get('Content-Length', '0') != '0':
+            self.close_connection = True
+        getattr(self, handler)()
     
-    def serve_config_form(self):
-        """Serve the configuration HTML form."""
+    def parse_query(self):
+        """
+        Parse the query string into a flat dict (last value wins).
+        Sends a 400 and returns None if it has more fields than any route takes.
+        """
         try:
-            # Try to read from installed location first, then fallback to local
-            html_paths = [
-                CONFIG_HTML_PATH,
-                os.path.join(os.path.dirname(__file__), "templates", "config.html"),
-                "templates/config.html"
-            ]
-            
-            html_content = None
-            for path in html_paths:
-                if os.path.exists(path):
-                    with open(path, 'r', encoding='utf-8') as f:
-                        html_content = f.read()
-                    break
-            
-            if html_content is None:
-                self.send_error(500, "Configuration form not found")
-                return
-            
-            self.send_response(200)
-            self.send_header("Content-type", "text/html; charset=utf-8")
+            return dict(urllib.parse.parse_qsl(self.query, max_num_fields=MAX_QUERY_FIELDS))
+        except ValueError:
+            self.send_json_response(400, {"error": "Too many query parameters"})
+            return None
+    
+    def read_body(self):
+        """
+        Read the request body (at most MAX_BODY_BYTES) into one preallocated buffer.
+        Sends a 400 or 413, closing the connection, and returns None if it can't be read.
+        """
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_BYTES:
+            # The body stays unread, so this connection can't carry another request
+            self.close_connection = True
+            self.send_json_bytes(413 if length > 0 else 400,
+                                 CANNED_ERRORS["body_too_large" if length > 0 else "bad_content_length"])
+            return None
+        body = bytearray(length)
+        view = memoryview(body)
+        received = 0
+        while received < length:
+            n = self.rfile.readinto(view[received:])
+            if not n:
+                break
+            received += n
+        view.release()
+        if received < length:
+            del body[received:]
+        return body
+    
+    def route_logs(self):
+        """GET /logs?service=...&lines=..."""
+        params = self.parse_query()
+        if params is None:
+            return
+        service = params.get('service', 'network-manager')
+        try:
+            lines = max(1, min(int(params.get('lines', '100')), MAX_LOG_LINES))
+        except ValueError:
+            lines = 100
+        self.serve_logs(service, lines)
+    
+    def route_check_manifest(self):
+        """GET /check-manifest?url=..."""
+        params = self.parse_query()
+        if params is None:
+            return
+        self.check_manifest(params.get('url', ''))
+    
+    def route_scan_wifi(self):
+        """GET /scan-wifi (scan_wifi() takes WIFI_LOCK itself, only when it scans)"""
+        self.scan_wifi_networks()
+    
+    def route_test_wifi(self):
+        """GET /test-wifi?ssid=...&password=..."""
+        params = self.parse_query()
+        if params is None:
+            return
+        ssid = params.get('ssid', '')
+        password = params.get('password', '')
+        with WIFI_LOCK:
+            self.test_wifi_connection(ssid, password)
+    
+    def route_check_auth(self):
+        """GET /check-auth: report whether a web password is set."""
+        try:
+            has_password = load_web_password() is not None
+        except OSError:
+            has_password = True  # Present but unreadable
+        self.send_json_response(200, {"has_password": has_password})
+    
+    def serve_config_form(self):
+        """Serve the configuration HTML form from the in-memory cache."""
+        refresh_config_html()
+        form = CACHED_FORM
+        if form is None:
+            self.send_error(500, "Configuration form not found")
+            return
+        html, html_gz, etag = form
+        
+        if_none_match = self.headers.get('If-None-Match', '')
+        if etag in (tag.strip() for tag in if_none_match.split(',')):
+            self.send_response(304)
+            self.send_header("ETag", etag)
             self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
-        except Exception as e:
-            print(f"[config-server] Error serving form: {e}", flush=True)
-            self.send_error(500, f"Server error: {e}")
+            return
+        
+        # Most of the page load over the hotspot is transfer time; send it compressed when possible
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = html_gz if use_gzip else html
+        
+        self.send_response(200)
+        self.send_header("Content-type", "text/html; charset=utf-8")
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "private, max-age=60")
+        self.end_headers()
+        self.wfile.write(body)
     
     def serve_status(self):
         """Serve current network status as JSON."""
         try:
-            # Import network manager functions
-            sys.path.insert(0, os.path.dirname(__file__))
-            try:
-                # Import using importlib to handle hyphenated module name
-                import importlib.util
-                network_manager_path = os.path.join(os.path.dirname(__file__), "network-manager.py")
-                if os.path.exists(network_manager_path):
-                    spec = importlib.util.spec_from_file_location("network_manager", network_manager_path)
-                    network_manager = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(network_manager)
-                    has_ip, has_internet = network_manager.has_network_connectivity()
-                    hotspot_running = network_manager.is_hotspot_running()
-                else:
-                    raise ImportError("network-manager.py not found")
-            except Exception:
-                # Fallback if network-manager not available
-                has_ip = False
-                has_internet = False
-                hotspot_running = False
-            
-            # Get manifest URL from stream-player service
-            manifest_url = ""
-            try:
-                result = subprocess.run(
-                    ["systemctl", "show", "stream-player.service", "--property=Environment"],
-                    capture_output=True,
-                    text=True,
-                    check=False
-                )
-                for line in result.stdout.splitlines():
-                    if "STREAM_MANIFEST_URL=" in line:
-                        # Extract just the URL part (before any space or next env var)
-                        env_line = line.split("STREAM_MANIFEST_URL=", 1)[1]
-                        # Take only the URL part (until space or quote)
-                        manifest_url = env_line.split()[0].strip('"').strip("'")
-                        # Remove any trailing environment variable names
-                        manifest_url = manifest_url.split()[0] if manifest_url else ""
-                        break
-            except Exception:
-                pass
-            
-            # Get current volume (try to read from amixer)
-            volume = None
-            try:
-                result = subprocess.run(
-                    ["amixer", "get", "PCM"],
-                    capture_output=True,
-                    text=True,
-                    check=False
-                )
-                # Parse volume from amixer output
-                for line in result.stdout.splitlines():
-                    if "%" in line and "[" in line:
-                        match = re.search(r'\[(\d+)%\]', line)
-                        if match:
-                            volume = int(match.group(1))
-                            break
-            except Exception:
-                pass
-            
-            # Get current hotspot SSID from hostapd config
-            hotspot_ssid = ""
-            try:
-                if os.path.exists("/etc/hostapd/hostapd.conf"):
-                    with open("/etc/hostapd/hostapd.conf", 'r') as f:
-                        for line in f:
-                            if line.strip().startswith("ssid="):
-                                hotspot_ssid = line.split("=", 1)[1].strip()
-                                break
-            except Exception:
-                pass
+            # The probes don't depend on each other, so wait for the slowest, not the sum
+            connectivity = STATUS_EXECUTOR.submit(_cached, "connectivity", 2.0, _get_connectivity)
+            hotspot = STATUS_EXECUTOR.submit(_cached, "hotspot_running", 2.0, _get_hotspot_running)
+            manifest = STATUS_EXECUTOR.submit(_cached, "manifest_url", 2.0, _get_manifest_url)
+            mixer = STATUS_EXECUTOR.submit(_cached, "volume", 2.0, _get_volume)
+            hotspot_ssid = _cached("hotspot_ssid", 5.0, _get_hotspot_ssid)
+            
+            has_ip, has_internet = connectivity.result()
+            hotspot_running = hotspot.result()
+            manifest_url = manifest.result()
+            volume = mixer.result()
             
             status = {
                 "has_ip": has_ip,
@@ -241,10 +1119,7 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
                 "hotspot_ssid": hotspot_ssid
             }
             
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(status).encode('utf-8'))
+            self.send_json_response(200, status)
         except Exception as e:
             print(f"[config-server] Error getting status: {e}", flush=True)
             self.send_error(500, f"Server error: {e}")
@@ -252,108 +1127,44 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def handle_configure(self):
         """Handle network configuration POST request."""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
-            
-            # Validate required fields
-            network_type = data.get('network_type')
-            if not network_type:
-                self.send_json_response(400, {"error": "Network type is required"})
+            post_data = self.read_body()
+            if post_data is None:
                 return
+            data = _json.loads(post_data)
             
-            if network_type == "wifi":
-                ssid = data.get('wifi_ssid')
-                if not ssid:
-                    self.send_json_response(400, {"error": "WiFi SSID is required"})
-                    return
-                password = data.get('wifi_password', '')
-            elif network_type == "lan":
-                # Check if DHCP is requested
-                lan_dhcp = data.get('lan_dhcp', False)
-                if isinstance(lan_dhcp, str):
-                    lan_dhcp = lan_dhcp.lower() in ('true', '1', 'yes', 'on')
-                
-                if not lan_dhcp:
-                    # Validate LAN static IP fields
-                    ip = data.get('lan_ip')
-                    subnet = data.get('lan_subnet')
-                    gateway = data.get('lan_gateway')
-                    dns = data.get('lan_dns', '8.8.8.8')
-                    
-                    if not all([ip, subnet, gateway]):
-                        self.send_json_response(400, {"error": "IP, subnet, and gateway are required for LAN static IP, or use DHCP"})
-                        return
-                else:
-                    # DHCP mode - no static IP fields needed
-                    ip = None
-                    subnet = None
-                    gateway = None
-                    dns = None
-            else:
-                self.send_json_response(400, {"error": "Invalid network type"})
+            ok, result = build_configure_args(data)
+            if not ok:
+                self.send_json_response(400, {"error": result})
                 return
             
-            # Call network-config.py to apply configuration
-            if not os.path.exists(NETWORK_CONFIG_SCRIPT):
-                # Try local path
-                local_script = os.path.join(os.path.dirname(__file__), "network-config.py")
-                if os.path.exists(local_script):
-                    script_path = local_script
-                else:
-                    self.send_json_response(500, {"error": "Network configuration script not found"})
-                    return
-            else:
-                script_path = NETWORK_CONFIG_SCRIPT
-            
-            # Build command
-            cmd = ["python3", script_path, "--network-type", network_type]
-            if network_type == "wifi":
-                cmd.extend(["--ssid", ssid])
-                if password:
-                    cmd.extend(["--password", password])
-            else:  # lan
-                if lan_dhcp:
-                    cmd.extend(["--dhcp"])
-                else:
-                    cmd.extend([
-                        "--ip", ip,
-                        "--subnet", subnet,
-                        "--gateway", gateway
-                    ])
-                    if dns:
-                        cmd.extend(["--dns", dns])
-            
-            # Run configuration script
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=60  # Increased timeout for WiFi connection monitoring
-            )
-            
-            # Forward network-config output to logs
-            if result.stdout:
-                for line in result.stdout.splitlines():
-                    print(f"[config-server] {line}", flush=True)
-            if result.stderr:
-                for line in result.stderr.splitlines():
-                    print(f"[config-server] {line}", flush=True)
+            if _NETCFG_MODULE is None:
+                self.send_json_response(500, {"error": "Network configuration script not found"})
+                return
             
-            if result.returncode == 0:
-                self.send_json_response(200, {
-                    "message": "Configuration applied successfully. Network services will restart."
-                })
-            else:
-                error_msg = result.stderr or result.stdout or "Unknown error"
+            # Apply through network-config.py's apply() in-process rather than
+            # starting an interpreter per request; every nmcli call it makes has
+            # a timeout. Its output goes straight to our log.
+            try:
+                with WIFI_LOCK:
+                    _NETCFG_MODULE.forget_connections()
+                    _NETCFG_MODULE.apply(result)
+            except subprocess.TimeoutExpired as e:
+                print(f"[config-server] Configuration timed out: {e}", flush=True)
+                self.send_json_response(500, {"error": "Configuration timeout"})
+                return
+            except Exception as e:
+                print(f"[config-server] Error applying configuration: {e}", flush=True)
                 self.send_json_response(500, {
-                    "error": f"Failed to apply configuration: {error_msg}"
+                    "error": f"Failed to apply configuration: {e}"
                 })
+                return
+            
+            self.send_json_response(200, {
+                "message": "Configuration applied successfully. Network services will restart."
+            })
         
-        except subprocess.TimeoutExpired:
-            self.send_json_response(500, {"error": "Configuration timeout"})
         except json.JSONDecodeError:
-            self.send_json_response(400, {"error": "Invalid JSON"})
+            self.send_json_bytes(400, CANNED_ERRORS["invalid_json"])
         except Exception as e:
             print(f"[config-server] Error handling configure: {e}", flush=True)
             self.send_json_response(500, {"error": str(e)})
@@ -366,19 +1177,55 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_json_response(400, {"error": f"Invalid service. Must be one of: {', '.join(valid_services)}"})
                 return
             
-            result = subprocess.run(
-                ["journalctl", "-u", f"{service}.service", "-n", str(lines), "--no-pager"],
-                capture_output=True,
-                text=True,
-                timeout=5
+            process = subprocess.Popen(
+                ["journalctl", "-u", f"{service}.service", "-n", str(lines),
+                 "--no-pager", "--output=short", "--no-hostname"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=LOG_CHUNK_SIZE
             )
-            
-            if result.returncode == 0:
-                self.send_json_response(200, {"logs": result.stdout})
-            else:
-                self.send_json_response(500, {"error": result.stderr or "Failed to get logs"})
-        except subprocess.TimeoutExpired:
-            self.send_json_response(500, {"error": "Timeout getting logs"})
+            timer = threading.Timer(5, process.kill)
+            timer.start()
+            try:
+                # Stream the journal as plain text rather than copying it into a JSON string.
+                # Wait for the first chunk so a failing journalctl still gets a JSON error.
+                chunk = process.stdout.read1(LOG_CHUNK_SIZE)
+                if not chunk:
+                    stderr = process.stderr.read()
+                    returncode = process.wait()
+                    if not timer.is_alive():
+                        self.send_json_response(500, {"error": "Timeout getting logs"})
+                    elif returncode != 0:
+                        error = stderr.decode('utf-8', 'replace') or "Failed to get logs"
+                        self.send_json_response(500, {"error": error})
+                    else:
+                        self.send_response(200)
+                        self.send_header("Content-type", "text/plain; charset=utf-8")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                    return
+                
+                # No Content-Length: the end of the body is the end of the connection
+                self.send_response(200)
+                self.send_header("Content-type", "text/plain; charset=utf-8")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    # wfile is buffered (wbufsize); flush each chunk so the
+                    # client sees the log as journalctl produces it
+                    while chunk:
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                        chunk = process.stdout.read1(LOG_CHUNK_SIZE)
+                except OSError:
+                    # Client went away mid-stream; nothing left to report to it
+                    process.kill()
+                process.wait()
+            finally:
+                timer.cancel()
+                process.stdout.close()
+                process.stderr.close()
         except Exception as e:
             print(f"[config-server] Error getting logs: {e}", flush=True)
             self.send_json_response(500, {"error": str(e)})
@@ -386,7 +1233,7 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def check_manifest(self, url):
         """Check if manifest URL is accessible."""
         if not url:
-            self.send_json_response(400, {"error": "URL is required"})
+            self.send_json_bytes(400, CANNED_ERRORS["url_required"])
             return
         
         # Clean up URL - remove any extra whitespace or environment variables
@@ -396,24 +1243,24 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
         
         # Basic URL validation
         if not url.startswith(('http://', 'https://')):
-            self.send_json_response(400, {"error": "URL must start with http:// or https://"})
+            self.send_json_bytes(400, CANNED_ERRORS["url_scheme"])
             return
         
         try:
-            req = urllib.request.Request(url, headers={"User-Agent": "bartix-config/1.0"})
-            with urllib.request.urlopen(req, timeout=10) as response:
-                data = json.loads(response.read().decode('utf-8'))
-                stream_url = data.get('stream_url', '')
+            status, reason, body = pooled_get(url, {"User-Agent": "bartix-config/1.0"})
+            if not 200 <= status < 300:
                 self.send_json_response(200, {
-                    "accessible": True,
-                    "stream_url": stream_url
+                    "accessible": False,
+                    "error": f"HTTP {status}: {reason}"
                 })
-        except urllib.error.HTTPError as e:
+                return
+            data = _json.loads(body)
+            stream_url = data.get('stream_url', '')
             self.send_json_response(200, {
-                "accessible": False,
-                "error": f"HTTP {e.code}: {e.reason}"
+                "accessible": True,
+                "stream_url": stream_url
             })
-        except urllib.error.URLError as e:
+        except (http.client.HTTPException, OSError) as e:
             self.send_json_response(200, {
                 "accessible": False,
                 "error": f"URL Error: {str(e)}"
@@ -432,48 +1279,34 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def handle_update_manifest(self):
         """Handle manifest URL update."""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            post_data = self.read_body()
+            if post_data is None:
+                return
+            data = _json.loads(post_data)
             
             url = data.get('url')
             if not url:
-                self.send_json_response(400, {"error": "URL is required"})
+                self.send_json_bytes(400, CANNED_ERRORS["url_required"])
                 return
             
-            # Update systemd service environment variable
-            service_file = "/etc/systemd/system/stream-player.service"
-            if not os.path.exists(service_file):
-                self.send_json_response(500, {"error": "Service file not found"})
+            if '\n' in url or '\r' in url:
+                self.send_json_response(400, {"error": "URL must not contain line breaks"})
                 return
             
-            # Read current service file
-            with open(service_file, 'r') as f:
-                content = f.read()
-            
-            # Update STREAM_MANIFEST_URL
-            pattern = r'Environment=STREAM_MANIFEST_URL=.*'
-            replacement = f'Environment=STREAM_MANIFEST_URL={url}'
+            # Override STREAM_MANIFEST_URL with a drop-in instead of rewriting the unit
+            changed = write_unit_environment("stream-player.service", "manifest.conf", {"STREAM_MANIFEST_URL": url})
             
-            if re.search(pattern, content):
-                content = re.sub(pattern, replacement, content)
-            else:
-                # Add it if it doesn't exist
-                content = content.replace(
-                    '[Service]',
-                    f'[Service]\n{replacement}'
-                )
-            
-            # Write back
-            with open(service_file, 'w') as f:
-                f.write(content)
-            
-            # Reload systemd and restart service
-            subprocess.run(["systemctl", "daemon-reload"], check=True)
-            subprocess.run(["systemctl", "restart", "stream-player.service"], check=False)
+            # Reload systemd (only needed if the drop-in changed) and restart service.
+            # stream-player is Type=notify, so a blocking restart would hold this
+            # request until the new manifest is fetched and playback is up;
+            # queue the job and answer right away.
+            if changed:
+                subprocess.run(["systemctl", "daemon-reload"], check=True)
+            subprocess.run(["systemctl", "--no-block", "restart", "stream-player.service"], check=False)
+            _STATUS_CACHE.pop("manifest_url", None)
             
             self.send_json_response(200, {
-                "message": "Manifest URL updated successfully. Service restarted."
+                "message": "Manifest URL updated successfully. Service is restarting."
             })
         except Exception as e:
             print(f"[config-server] Error updating manifest: {e}", flush=True)
@@ -482,25 +1315,20 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def handle_set_volume(self):
         """Handle volume setting."""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            post_data = self.read_body()
+            if post_data is None:
+                return
+            data = _json.loads(post_data)
             
             volume = data.get('volume')
             if volume is None:
-                self.send_json_response(400, {"error": "Volume is required"})
+                self.send_json_bytes(400, CANNED_ERRORS["volume_required"])
                 return
             
             volume = max(0, min(100, int(volume)))
             
-            # Set volume using amixer
-            for ctl in ("PCM", "Headphone", "Speaker"):
-                result = subprocess.run(
-                    ["amixer", "set", ctl, f"{volume}%"],
-                    capture_output=True,
-                    text=True,
-                    check=False
-                )
+            set_mixer_volume(volume)
+            _STATUS_CACHE.pop("volume", None)
             
             self.send_json_response(200, {
                 "message": f"Volume set to {volume}%"
@@ -512,79 +1340,73 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def handle_update_hotspot(self):
         """Handle hotspot SSID and password update."""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            post_data = self.read_body()
+            if post_data is None:
+                return
+            data = _json.loads(post_data)
             
             ssid = data.get('ssid', '').strip()
             password = data.get('password', '').strip()
             
             if not ssid:
-                self.send_json_response(400, {"error": "SSID is required"})
+                self.send_json_bytes(400, CANNED_ERRORS["ssid_required"])
                 return
             
             if password and len(password) < 8:
-                self.send_json_response(400, {"error": "Password must be at least 8 characters"})
+                self.send_json_bytes(400, CANNED_ERRORS["hotspot_password_short"])
+                return
+            
+            if any(c in ssid or c in password for c in '\r\n'):
+                self.send_json_response(400, {"error": "SSID and password must not contain line breaks"})
                 return
             
             # Read current hostapd config
             hostapd_conf = "/etc/hostapd/hostapd.conf"
-            if not os.path.exists(hostapd_conf):
+            try:
+                content = Path(hostapd_conf).read_text()
+            except FileNotFoundError:
                 self.send_json_response(500, {"error": "hostapd config file not found"})
                 return
             
-            with open(hostapd_conf, 'r') as f:
-                content = f.read()
-            
             # Update SSID
-            content = re.sub(r'^ssid=.*$', f'ssid={ssid}', content, flags=re.MULTILINE)
+            content = HOSTAPD_SSID_RE.sub(f'ssid={ssid}', content)
             
             # Update password if provided
             if password:
-                content = re.sub(r'^wpa_passphrase=.*$', f'wpa_passphrase={password}', content, flags=re.MULTILINE)
+                content = HOSTAPD_PASSPHRASE_RE.sub(f'wpa_passphrase={password}', content)
                 # Ensure WPA is enabled
                 if 'wpa=2' not in content:
-                    content = re.sub(r'^wpa=.*$', 'wpa=2', content, flags=re.MULTILINE)
+                    content = HOSTAPD_WPA_RE.sub('wpa=2', content)
             else:
                 # If no password provided, keep existing password (don't change it)
                 pass
             
             # Write updated config
-            with open(hostapd_conf, 'w') as f:
-                f.write(content)
-            
-            # Update systemd service environment variables
-            service_file = "/etc/systemd/system/network-manager.service"
-            if os.path.exists(service_file):
-                with open(service_file, 'r') as f:
-                    service_content = f.read()
-                
-                # Update HOTSPOT_SSID
-                service_content = re.sub(
-                    r'Environment=HOTSPOT_SSID=.*',
-                    f'Environment=HOTSPOT_SSID={ssid}',
-                    service_content
-                )
-                
-                # Update HOTSPOT_PASSWORD if password provided
-                if password:
-                    service_content = re.sub(
-                        r'Environment=HOTSPOT_PASSWORD=.*',
-                        f'Environment=HOTSPOT_PASSWORD={password}',
-                        service_content
-                    )
-                
-                with open(service_file, 'w') as f:
-                    f.write(service_content)
-                
-                # Reload systemd
-                subprocess.run(["systemctl", "daemon-reload"], check=True)
-            
-            # Restart hostapd to apply changes
-            subprocess.run(["systemctl", "restart", "hostapd"], check=False)
+            hostapd_changed = write_file_atomic(hostapd_conf, content)
             
-            # Restart network-manager to pick up new environment variables
-            subprocess.run(["systemctl", "restart", "network-manager.service"], check=False)
+            # Update network-manager's environment through drop-ins; the password
+            # has its own (private) file so an SSID-only change keeps it
+            env_changed = write_unit_environment("network-manager.service", "hotspot-ssid.conf", {"HOTSPOT_SSID": ssid})
+            if password:
+                env_changed |= write_unit_environment("network-manager.service", "hotspot-password.conf",
+                                                      {"HOTSPOT_PASSWORD": password}, mode=0o600)
+            
+            # Restart hostapd for a new config and network-manager to pick up
+            # new environment variables, with one systemctl call. Restarting
+            # hostapd drops every client of the hotspot, so leave the services
+            # alone when the settings are already in place. --no-block queues
+            # both jobs to run side by side and lets this response go out
+            # before the hotspot goes down.
+            restart_units = []
+            if hostapd_changed:
+                restart_units.append("hostapd")
+            if env_changed:
+                subprocess.run(["systemctl", "daemon-reload"], check=True)
+                restart_units.append("network-manager.service")
+            if restart_units:
+                subprocess.run(["systemctl", "--no-block", "restart", *restart_units], check=False)
+            _STATUS_CACHE.pop("hotspot_ssid", None)
+            _STATUS_CACHE.pop("hotspot_running", None)
             
             self.send_json_response(200, {
                 "message": f"Hotspot settings updated. SSID: {ssid}"
@@ -596,222 +1418,112 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def scan_wifi_networks(self):
         """Scan for available WiFi networks."""
         try:
-            # With AP+STA concurrent support, wlan0 (for scanning) and wlan0_ap (for hotspot) are separate
-            # No need to stop hostapd - scanning on wlan0 doesn't interfere with hotspot on wlan0_ap
-            
-            # Unblock WiFi
-            subprocess.run(
-                ["rfkill", "unblock", "wifi"],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            time.sleep(1)
-            
-            # Bring interface up if down
-            subprocess.run(
-                ["ip", "link", "set", "wlan0", "up"],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            time.sleep(1)
-            
-            # Scan for networks using iw (preferred)
-            result = subprocess.run(
-                ["iw", "dev", "wlan0", "scan"],
-                capture_output=True,
-                text=True,
-                timeout=20
-            )
-            
-            networks = []
-            scan_success = False
-            
-            if result.returncode == 0:
-                # Parse iw scan output
-                current_network = {}
-                for line in result.stdout.splitlines():
-                    line = line.strip()
-                    if line.startswith("BSS "):
-                        if current_network and "ssid" in current_network:
-                            networks.append(current_network)
-                        current_network = {}
-                    elif "SSID: " in line:
-                        ssid = line.split("SSID: ", 1)[1].strip()
-                        if ssid:
-                            current_network["ssid"] = ssid
-                    elif "signal: " in line:
-                        try:
-                            signal_str = line.split("signal: ", 1)[1].strip().split()[0]
-                            current_network["signal"] = int(float(signal_str))
-                        except:
-                            pass
-                    elif "freq: " in line:
-                        freq = line.split("freq: ", 1)[1].strip().split()[0]
-                        current_network["frequency"] = freq
-                
-                if current_network and "ssid" in current_network:
-                    networks.append(current_network)
-                scan_success = True
-            
-            # Try iwlist if iw failed or found no networks
-            if not scan_success or not networks:
-                result = subprocess.run(
-                    ["iwlist", "wlan0", "scan"],
-                    capture_output=True,
-                    text=True,
-                    timeout=20
-                )
-                
-                if result.returncode == 0:
-                    current_network = {}
-                    for line in result.stdout.splitlines():
-                        line = line.strip()
-                        if "Cell " in line and "Address:" in line:
-                            if current_network and "ssid" in current_network:
-                                networks.append(current_network)
-                            current_network = {}
-                        elif "ESSID:" in line:
-                            ssid = line.split("ESSID:", 1)[1].strip().strip('"')
-                            if ssid:
-                                current_network["ssid"] = ssid
-                        elif "Signal level=" in line:
-                            try:
-                                signal_str = line.split("Signal level=", 1)[1].strip().split()[0]
-                                # iwlist uses negative dBm, convert if needed
-                                signal = int(signal_str)
-                                if signal > 0:  # If positive, it's probably in different format
-                                    signal = -signal
-                                current_network["signal"] = signal
-                            except:
-                                pass
-                    
-                    if current_network and "ssid" in current_network:
-                        networks.append(current_network)
-                    scan_success = True
-            
-            # No need to restart hostapd - it continues running on wlan0_ap during scan
-            
-            if scan_success:
-                # Remove duplicates and sort by signal strength
-                seen = set()
-                unique_networks = []
-                for net in networks:
-                    ssid = net.get("ssid", "")
-                    if ssid and ssid not in seen and ssid != "":
-                        seen.add(ssid)
-                        unique_networks.append(net)
-                
-                # Sort by signal strength (higher is better)
-                unique_networks.sort(key=lambda x: x.get("signal", -100), reverse=True)
-                
-                self.send_json_response(200, {"networks": unique_networks})
-            else:
-                self.send_json_response(500, {
-                    "error": f"Failed to scan: {result.stderr or 'Unknown error'}"
-                })
+            # Bursts of requests share one scan (and a result less than
+            # WIFI_SCAN_TTL old) instead of each scanning wlan0
+            networks = _cached("wifi_scan", WIFI_SCAN_TTL, scan_wifi)
+            self.send_json_response(200, {"networks": networks})
+        except ScanError as e:
+            self.send_json_response(500, {"error": f"Failed to scan: {e}"})
         except subprocess.TimeoutExpired:
             self.send_json_response(500, {"error": "Scan timeout"})
         except Exception as e:
             print(f"[config-server] Error scanning WiFi: {e}", flush=True)
-            import traceback
             print(f"[config-server] Traceback: {traceback.format_exc()}", flush=True)
             self.send_json_response(500, {"error": str(e)})
     
     def test_wifi_connection(self, ssid, password):
         """Test WiFi connection without applying configuration."""
         if not ssid:
-            self.send_json_response(400, {"error": "SSID is required"})
+            self.send_json_bytes(400, CANNED_ERRORS["ssid_required"])
             return
         
         try:
             # With AP+STA concurrent support, wlan0 (for testing) and wlan0_ap (for hotspot) are separate
             # No need to stop hostapd - testing WiFi on wlan0 doesn't interfere with hotspot on wlan0_ap
             
-            # Create temporary wpa_supplicant config
-            import tempfile
-            temp_conf = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.conf')
-            temp_conf.write("country=NL\n")
-            temp_conf.write("ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev\n")
-            temp_conf.write("update_config=1\n\n")
-            temp_conf.write("network={\n")
-            temp_conf.write(f'    ssid="{ssid}"\n')
-            if password:
-                temp_conf.write(f'    psk="{password}"\n')
-            else:
-                temp_conf.write("    key_mgmt=NONE\n")
-            temp_conf.write("}\n")
-            temp_conf.close()
-            
-            # Stop existing wpa_supplicant
-            subprocess.run(
-                ["systemctl", "stop", "wpa_supplicant"],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
+            # Create temporary wpa_supplicant config, written in one go
+            security = f'psk="{password}"' if password else "key_mgmt=NONE"
+            conf = (
+                "country=NL\n"
+                "ctrl_interface=DIR=/var/run/wpa_supplicant GROUP=netdev\n"
+                "update_config=1\n\n"
+                "network={\n"
+                f'    ssid="{ssid}"\n'
+                f"    {security}\n"
+                "}\n"
             )
-            time.sleep(1)
             
-            # Unblock WiFi
-            subprocess.run(
-                ["rfkill", "unblock", "wifi"],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            
-            # Bring interface down and up
-            subprocess.run(
-                ["ip", "link", "set", "wlan0", "down"],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            time.sleep(1)
-            subprocess.run(
-                ["ip", "link", "set", "wlan0", "up"],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            time.sleep(2)
-            
-            # Start wpa_supplicant with temp config
-            result = subprocess.run(
-                ["wpa_supplicant", "-B", "-i", "wlan0", "-c", temp_conf.name, "-f", "/tmp/wpa_test.log"],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            
-            # Wait and check connection
-            time.sleep(5)
-            
-            # Check if we got an IP
-            result = subprocess.run(
-                ["ip", "addr", "show", "wlan0"],
-                capture_output=True,
-                text=True,
-                check=False
-            )
-            
-            has_ip = "inet " in result.stdout and "127.0.0.1" not in result.stdout
-            
-            # Kill test wpa_supplicant
-            subprocess.run(
-                ["pkill", "-f", f"wpa_supplicant.*{temp_conf.name}"],
-                check=False,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            
-            # Clean up temp file
+            # The config, log and PID file live in a fresh private (0700)
+            # directory: nothing stale from an earlier test, and nothing another
+            # local user could plant for root to read, write or kill
+            work_dir = tempfile.mkdtemp(prefix="wpa_test.")
             try:
-                os.unlink(temp_conf.name)
-                os.unlink("/tmp/wpa_test.log")
-            except:
-                pass
+                conf_path = os.path.join(work_dir, "wpa_supplicant.conf")
+                log_path = os.path.join(work_dir, "wpa_supplicant.log")
+                pid_path = os.path.join(work_dir, "wpa_supplicant.pid")
+                with open(conf_path, 'w') as f:
+                    f.write(conf)
+                
+                # Stop existing wpa_supplicant (systemctl returns once it has stopped)
+                # and unblock WiFi; the two are independent, so run them side by side
+                procs = [
+                    subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    for cmd in (["systemctl", "stop", "wpa_supplicant"], ["rfkill", "unblock", "wifi"])
+                ]
+                for proc in procs:
+                    proc.wait()
+                
+                # Bring interface down and up with one ip process (-force: carry on
+                # past a failed step, as separate commands would)
+                subprocess.run(
+                    ["ip", "-force", "-batch", "-"],
+                    input=b"link set wlan0 down\nlink set wlan0 up\n",
+                    check=False,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+                wait_for_interface_up("wlan0")
+                
+                # Start wpa_supplicant with temp config; -P records its PID so
+                # exactly this instance can be stopped afterwards
+                result = subprocess.run(
+                    ["wpa_supplicant", "-B", "-i", "wlan0", "-c", conf_path,
+                     "-f", log_path, "-P", pid_path],
+                    capture_output=True,
+                    text=True,
+                    timeout=5
+                )
+                
+                has_ip = False
+                error_msg = "Failed to connect"
+                if result.returncode == 0:
+                    # Check for an IP until one shows up, for at most 5 seconds
+                    has_ip = wait_until(lambda: interface_has_ipv4("wlan0"), 5)
+                    
+                    # Kill test wpa_supplicant (it only daemonized if -B exited 0)
+                    try:
+                        with open(pid_path, "r") as f:
+                            os.kill(int(f.read()), signal.SIGTERM)
+                    except (OSError, ValueError):
+                        pass
+                else:
+                    error_msg = f"Failed to start wpa_supplicant: {result.stderr.strip() or result.returncode}"
+                
+                # Check log for errors
+                if not has_ip and result.returncode == 0:
+                    try:
+                        # Searched as bytes; the log is never decoded
+                        with open(log_path, "rb") as f:
+                            log_content = f.read()
+                        if b"4-Way Handshake failed" in log_content:
+                            error_msg = "Incorrect password"
+                        elif b"auth_failures" in log_content:
+                            error_msg = "Authentication failed"
+                    except OSError:
+                        pass
+            finally:
+                # Clean up temp files, also after a timeout or error
+                shutil.rmtree(work_dir, ignore_errors=True)
             
             # No need to restart hostapd - it continues running on wlan0_ap during test
             
@@ -821,19 +1533,6 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
                     "message": "Successfully connected to WiFi network"
                 })
             else:
-                # Check log for errors
-                error_msg = "Failed to connect"
-                try:
-                    if os.path.exists("/tmp/wpa_test.log"):
-                        with open("/tmp/wpa_test.log", "r") as f:
-                            log_content = f.read()
-                            if "4-Way Handshake failed" in log_content:
-                                error_msg = "Incorrect password"
-                            elif "auth_failures" in log_content:
-                                error_msg = "Authentication failed"
-                except:
-                    pass
-                
                 self.send_json_response(200, {
                     "success": False,
                     "error": error_msg
@@ -847,50 +1546,23 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def clear_wifi_credentials(self):
         """Clear WiFi credentials by removing network blocks from wpa_supplicant.conf."""
         try:
-            # Call network-config.py to clear WiFi
-            if not os.path.exists(NETWORK_CONFIG_SCRIPT):
-                # Try local path
-                local_script = os.path.join(os.path.dirname(__file__), "network-config.py")
-                if os.path.exists(local_script):
-                    script_path = local_script
-                else:
-                    self.send_json_response(500, {"error": "Network configuration script not found"})
-                    return
-            else:
-                script_path = NETWORK_CONFIG_SCRIPT
-            
-            # Build command to clear WiFi
-            cmd = ["python3", script_path, "--clear-wifi"]
-            
-            # Run configuration script
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
-            
-            # Forward network-config output to logs
-            if result.stdout:
-                for line in result.stdout.splitlines():
-                    print(f"[config-server] {line}", flush=True)
-            if result.stderr:
-                for line in result.stderr.splitlines():
-                    print(f"[config-server] {line}", flush=True)
+            if _NETCFG_MODULE is None:
+                self.send_json_response(500, {"error": "Network configuration script not found"})
+                return
             
-            if result.returncode == 0:
+            # Call network-config.py's clear_wifi() in-process; the profile list
+            # it caches may have changed since the last request
+            with WIFI_LOCK:
+                _NETCFG_MODULE.forget_connections()
+                cleared = _NETCFG_MODULE.clear_wifi()
+            if cleared:
                 print(f"[config-server] WiFi credentials cleared successfully", flush=True)
                 self.send_json_response(200, {
                     "message": "WiFi credentials cleared successfully. System will fall back to hotspot mode."
                 })
             else:
-                error_msg = result.stderr or result.stdout or "Unknown error"
-                print(f"[config-server] Error clearing WiFi credentials: {error_msg}", flush=True)
-                self.send_json_response(500, {"error": f"Failed to clear WiFi credentials: {error_msg}"})
-        
-        except subprocess.TimeoutExpired:
-            print(f"[config-server] Timeout clearing WiFi credentials", flush=True)
-            self.send_json_response(500, {"error": "Timeout while clearing WiFi credentials"})
+                print(f"[config-server] Error clearing WiFi credentials", flush=True)
+                self.send_json_response(500, {"error": "Failed to clear WiFi credentials: could not delete the WiFi connection"})
         except Exception as e:
             print(f"[config-server] Error clearing WiFi credentials: {e}", flush=True)
             self.send_json_response(500, {"error": str(e)})
@@ -898,29 +1570,27 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     def handle_set_password(self):
         """Handle web interface password setting."""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            post_data = self.read_body()
+            if post_data is None:
+                return
+            data = _json.loads(post_data)
             
             password = data.get('password', '').strip()
             
             if not password:
-                self.send_json_response(400, {"error": "Password is required"})
+                self.send_json_bytes(400, CANNED_ERRORS["password_required"])
                 return
             
             if len(password) < 4:
-                self.send_json_response(400, {"error": "Password must be at least 4 characters"})
+                self.send_json_bytes(400, CANNED_ERRORS["password_short"])
                 return
             
             # Create directory if it doesn't exist
             os.makedirs(os.path.dirname(WEB_PASSWORD_FILE), exist_ok=True)
             
-            # Store password (in production, should be hashed, but for simplicity we'll store plaintext)
-            with open(WEB_PASSWORD_FILE, 'w') as f:
-                f.write(password)
-            
-            # Set restrictive permissions
-            os.chmod(WEB_PASSWORD_FILE, 0o600)
+            # Store a salted hash of the password. The temporary file is
+            # created 0600, so it is never readable by others.
+            write_file_atomic(WEB_PASSWORD_FILE, hash_web_password(password) + "\n", mode=0o600)
             
             self.send_json_response(200, {
                 "message": "Password set successfully. Please refresh the page and log in."
@@ -948,28 +1618,106 @@ class ConfigHandler(http.server.SimpleHTTPRequestHandler):
     
     def send_json_response(self, status_code, data):
         """Send JSON response."""
+        self.send_json_bytes(status_code, _dumps(data))
+    
+    def send_json_bytes(self, status_code, body):
+        """Send an already encoded JSON body."""
         self.send_response(status_code)
         self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
+        self.wfile.write(body)
+    
+    def log_error(self, format, *args):
+        """Don't log idle keep-alive connections timing out; that's routine."""
+        if format.startswith("Request timed out"):
+            return
+        super().log_error(format, *args)
     
     def log_message(self, format, *args):
         """Override to use print instead of stderr."""
         print(f"[config-server] {format % args}", flush=True)
 
 
+class ConfigServer(http.server.ThreadingHTTPServer):
+    """
+    Threaded HTTP server that can rebind its port immediately after a restart.
+    At most REQUEST_THREADS connections are handled at once; further ones wait
+    in the listen queue until a handler finishes. Handler threads are daemons,
+    so stopping the server doesn't wait for a keep-alive read or a /configure.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+    # Browsers open several connections at once when loading the page
+    request_queue_size = 128
+    
+    def __init__(self, server_address, handler_class):
+        self.request_slots = threading.BoundedSemaphore(REQUEST_THREADS)
+        super().__init__(server_address, handler_class)
+    
+    def process_request(self, request, client_address):
+        # Don't accept more work until a handler thread is free
+        self.request_slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self.request_slots.release()
+            raise
+    
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.request_slots.release()
+
+
+def fork_workers(httpd, count):
+    """Fork count extra processes that serve from the same listening socket."""
+    pids = []
+    for _ in range(count):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                httpd.serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    return pids
+
+
 def main():
     """Start the configuration server."""
+    global WIFI_LOCK
+    load_config_html()
+    load_network_manager()
+    load_network_config()
+    workers = []
     try:
-        with socketserver.TCPServer(("", CONFIG_SERVER_PORT), ConfigHandler) as httpd:
+        # Threaded so a slow /configure or /scan-wifi doesn't stall /status polling
+        with ConfigServer(("", CONFIG_SERVER_PORT), ConfigHandler) as httpd:
             print(f"[config-server] Configuration server started on port {CONFIG_SERVER_PORT}", flush=True)
             print(f"[config-server] Access at http://192.168.4.1:{CONFIG_SERVER_PORT}", flush=True)
+            if CONFIG_SERVER_WORKERS > 1:
+                # Created before forking so all workers share it
+                WIFI_LOCK = multiprocessing.Lock()
+                # Unwind through the finally below so the workers are stopped too
+                signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+                workers = fork_workers(httpd, CONFIG_SERVER_WORKERS - 1)
+                print(f"[config-server] Serving with {CONFIG_SERVER_WORKERS} worker processes", flush=True)
+                print(f"[config-server] Warning: the failed-login throttle is per process; "
+                      f"{CONFIG_SERVER_WORKERS} workers allow {CONFIG_SERVER_WORKERS}x the password guesses", flush=True)
             httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n[config-server] Server stopped", flush=True)
     except Exception as e:
         print(f"[config-server] Server error: {e}", flush=True)
         sys.exit(1)
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
 
 
 if __name__ == "__main__":
@@ -6,41 +6,59 @@ Applies WiFi or LAN (static IP) configuration changes using NetworkManager.
 import os
 import sys
 import argparse
+import shutil
 import subprocess
+import traceback
 import ipaddress
-import time
-import re
+import fcntl
+import socket
+import struct
+from functools import lru_cache
 
 # NetworkManager connection name for WiFi client
 WIFI_CONNECTION_NAME = "WiFi-Client"
 
+# nmcli resolved against PATH once, rather than by every exec
+NMCLI = shutil.which("nmcli") or "nmcli"
+
+# Seconds any single nmcli call may take; activations get their --wait on top.
+# config-server runs apply() in a request thread, so nothing may block forever.
+NMCLI_TIMEOUT = 15
+
+SIOCGIFADDR = 0x8915
+
+
+# The same address/gateway/DNS strings come back on every LAN apply
+_parse_ipv4 = lru_cache(maxsize=256)(ipaddress.IPv4Address)
+
 
 def validate_ip(ip_str):
     """Validate IP address format."""
     try:
-        ipaddress.IPv4Address(ip_str)
+        _parse_ipv4(ip_str)
         return True
     except ValueError:
         return False
 
 
-def validate_subnet(subnet_str):
-    """Validate subnet mask format."""
-    try:
-        ipaddress.IPv4Address(subnet_str)
-        return True
-    except ValueError:
-        return False
+@lru_cache(maxsize=64)
+def subnet_prefix_length(subnet_str):
+    """
+    Return the prefix length of a subnet mask, given dotted ("255.255.255.128")
+    or as a prefix ("25" or "/25"); ValueError if invalid.
+    """
+    return ipaddress.IPv4Network(f"0.0.0.0/{subnet_str.lstrip('/')}").prefixlen
 
 
-def nmcli_run(cmd, check=True, capture_output=True):
-    """Run nmcli command and return result."""
-    full_cmd = ["nmcli"] + cmd
+def nmcli_run(cmd, check=True, capture_output=True, timeout=NMCLI_TIMEOUT):
+    """Run nmcli command and return result; subprocess.TimeoutExpired after timeout seconds."""
+    full_cmd = [NMCLI] + cmd
     result = subprocess.run(
         full_cmd,
         capture_output=capture_output,
         text=True,
-        check=False
+        check=False,
+        timeout=timeout
     )
     if check and result.returncode != 0:
         print(f"[network-config] nmcli command failed: {' '.join(full_cmd)}", flush=True)
@@ -49,6 +67,42 @@ def nmcli_run(cmd, check=True, capture_output=True):
     return result
 
 
+# Names of NetworkManager's connection profiles, listed once by
+# connection_exists() and forgotten when this script adds or deletes one
+_CONNECTION_NAMES = None
+
+
+def connection_exists(name):
+    """Return whether a NetworkManager connection profile called name exists."""
+    global _CONNECTION_NAMES
+    if _CONNECTION_NAMES is None:
+        # Terse, unescaped, name column only: one name per line
+        result = nmcli_run(["-t", "-e", "no", "-f", "NAME", "connection", "show"], check=False)
+        if result.returncode != 0:
+            return False
+        _CONNECTION_NAMES = set(result.stdout.splitlines())
+    return name in _CONNECTION_NAMES
+
+
+def forget_connections():
+    """Drop the cached connection list after adding or deleting a profile."""
+    global _CONNECTION_NAMES
+    _CONNECTION_NAMES = None
+
+
+def get_ipv4_address(interface):
+    """Return the IPv4 address of interface, or None (ioctl, no subprocess)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        result = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", interface[:15].encode()))
+        return socket.inet_ntoa(result[20:24])
+    except OSError:
+        # EADDRNOTAVAIL: no IPv4 address; ENODEV: no such interface
+        return None
+    finally:
+        s.close()
+
+
 def configure_wifi(ssid, password=None):
     """
     Configure WiFi connection using NetworkManager.
@@ -60,19 +114,15 @@ def configure_wifi(ssid, password=None):
     print(f"[network-config] Configuring WiFi: {ssid}", flush=True)
     print("[network-config] WiFi client will use wlan0, hotspot continues on wlan0_ap", flush=True)
     
-    # Check if connection already exists
-    result = nmcli_run(["connection", "show", WIFI_CONNECTION_NAME], check=False)
-    connection_exists = (result.returncode == 0)
-    
-    if connection_exists:
+    if connection_exists(WIFI_CONNECTION_NAME):
         print(f"[network-config] Updating existing WiFi connection '{WIFI_CONNECTION_NAME}'...", flush=True)
-        # Update existing connection
-        nmcli_run(["connection", "modify", WIFI_CONNECTION_NAME, "wifi.ssid", ssid], check=False)
+        # Update existing connection (one nmcli call sets every property)
+        cmd = ["connection", "modify", WIFI_CONNECTION_NAME, "wifi.ssid", ssid]
         if password:
-            nmcli_run(["connection", "modify", WIFI_CONNECTION_NAME, "wifi-sec.key-mgmt", "wpa-psk"], check=False)
-            nmcli_run(["connection", "modify", WIFI_CONNECTION_NAME, "wifi-sec.psk", password], check=False)
+            cmd.extend(["wifi-sec.key-mgmt", "wpa-psk", "wifi-sec.psk", password])
         else:
-            nmcli_run(["connection", "modify", WIFI_CONNECTION_NAME, "wifi-sec.key-mgmt", "none"], check=False)
+            cmd.extend(["wifi-sec.key-mgmt", "none"])
+        nmcli_run(cmd, check=False)
     else:
         print(f"[network-config] Creating new WiFi connection '{WIFI_CONNECTION_NAME}'...", flush=True)
         # Create new connection
@@ -90,108 +140,41 @@ def configure_wifi(ssid, password=None):
             cmd.extend(["wifi-sec.key-mgmt", "none"])
         
         result = nmcli_run(cmd)
+        forget_connections()
         if result.returncode != 0:
             print(f"[network-config] Error creating WiFi connection: {result.stderr}", flush=True)
             return False
     
     print(f"[network-config] WiFi configuration updated", flush=True)
     
-    # Activate the connection
+    # Activate the connection. nmcli follows the activation over D-Bus and
+    # returns as soon as it is up with an IP, or has failed
     print("[network-config] Activating WiFi connection...", flush=True)
-    result = nmcli_run(["connection", "up", WIFI_CONNECTION_NAME], check=False)
-    
-    if result.returncode != 0:
-        print(f"[network-config] Warning: Failed to activate connection: {result.stderr}", flush=True)
-        print("[network-config] Connection will be activated automatically when network is available", flush=True)
-    
-    # Monitor WiFi connection status
-    print("[network-config] Monitoring WiFi connection status...", flush=True)
     max_wait = 30  # Wait up to 30 seconds for connection
-    check_interval = 2  # Check every 2 seconds
+    result = nmcli_run(["--wait", str(max_wait), "connection", "up", WIFI_CONNECTION_NAME], check=False,
+                       timeout=max_wait + NMCLI_TIMEOUT)
     
-    for i in range(0, max_wait, check_interval):
-        time.sleep(check_interval)
-        
-        # Check if wlan0 has an IP address
-        result = subprocess.run(
-            ["ip", "addr", "show", "wlan0"],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        
-        has_ip = False
-        ip_address = None
-        if result.returncode == 0:
-            # Look for inet address (not 127.0.0.1)
-            matches = re.findall(r'inet (\d+\.\d+\.\d+\.\d+)/', result.stdout)
-            for match in matches:
-                if match != "127.0.0.1":
-                    has_ip = True
-                    ip_address = match
-                    break
-        
-        # Check NetworkManager connection status
-        nm_status = "unknown"
-        nm_ssid = ""
-        result = nmcli_run(["connection", "show", "--active", WIFI_CONNECTION_NAME], check=False)
-        if result.returncode == 0:
-            # Parse connection info
-            for line in result.stdout.splitlines():
-                if "GENERAL.STATE:" in line:
-                    nm_status = line.split(":", 1)[1].strip() if ":" in line else "unknown"
-                elif "802-11-wireless.ssid:" in line:
-                    nm_ssid = line.split(":", 1)[1].strip() if ":" in line else ""
-        
-        # Log detailed status every 6 seconds (every 3rd check)
-        if (i // check_interval) % 3 == 0 and i > 0:
-            print(f"[network-config] Detailed status - State: {nm_status}, SSID: {nm_ssid or 'none'}", flush=True)
-        
-        if has_ip:
-            print(f"[network-config] ✓ WiFi connection successful!", flush=True)
-            print(f"[network-config] IP address: {ip_address}", flush=True)
-            print(f"[network-config] Connection state: {nm_status}", flush=True)
-            return True
-        else:
-            elapsed = i + check_interval
-            print(f"[network-config] Waiting for WiFi connection... ({elapsed}s/{max_wait}s, state: {nm_status})", flush=True)
-    
-    # Final check
-    result = subprocess.run(
-        ["ip", "addr", "show", "wlan0"],
-        capture_output=True,
-        text=True,
-        check=False
-    )
-    has_ip = False
-    ip_address = None
     if result.returncode == 0:
-        matches = re.findall(r'inet (\d+\.\d+\.\d+\.\d+)/', result.stdout)
-        for match in matches:
-            if match != "127.0.0.1":
-                has_ip = True
-                ip_address = match
-                break
-    
-    if has_ip:
-        print(f"[network-config] ✓ WiFi connection successful (after {max_wait}s)!", flush=True)
-        print(f"[network-config] IP address: {ip_address}", flush=True)
+        print(f"[network-config] ✓ WiFi connection successful!", flush=True)
+        print(f"[network-config] IP address: {get_ipv4_address('wlan0') or 'pending'}", flush=True)
         return True
-    else:
-        print(f"[network-config] ⚠ WiFi configuration applied but no IP address obtained after {max_wait}s", flush=True)
-        print(f"[network-config] Connection state: {nm_status}", flush=True)
-        
-        # Get final connection details
-        result = nmcli_run(["connection", "show", WIFI_CONNECTION_NAME], check=False)
-        if result.returncode == 0:
-            print(f"[network-config] Connection details:", flush=True)
-            for line in result.stdout.splitlines()[:10]:  # First 10 lines
-                if line.strip():
-                    print(f"[network-config]   {line}", flush=True)
-        
-        print(f"[network-config] Check connection status: nmcli connection show '{WIFI_CONNECTION_NAME}'", flush=True)
-        print(f"[network-config] Check device status: nmcli device status", flush=True)
-        return False
+    
+    print(f"[network-config] ⚠ WiFi configuration applied but the connection did not come up within {max_wait}s", flush=True)
+    if result.stderr:
+        print(f"[network-config] Error: {result.stderr.strip()}", flush=True)
+    print("[network-config] Connection will be activated automatically when network is available", flush=True)
+    
+    # Get final connection details
+    result = nmcli_run(["connection", "show", WIFI_CONNECTION_NAME], check=False)
+    if result.returncode == 0:
+        print(f"[network-config] Connection details:", flush=True)
+        for line in result.stdout.splitlines()[:10]:  # First 10 lines
+            if line.strip():
+                print(f"[network-config]   {line}", flush=True)
+    
+    print(f"[network-config] Check connection status: nmcli connection show '{WIFI_CONNECTION_NAME}'", flush=True)
+    print(f"[network-config] Check device status: nmcli device status", flush=True)
+    return False
 
 
 def clear_wifi():
@@ -201,20 +184,20 @@ def clear_wifi():
     """
     print(f"[network-config] Clearing WiFi credentials...", flush=True)
     
-    # Check if connection exists
-    result = nmcli_run(["connection", "show", WIFI_CONNECTION_NAME], check=False)
-    if result.returncode != 0:
+    if not connection_exists(WIFI_CONNECTION_NAME):
         print(f"[network-config] No WiFi connection found to clear", flush=True)
         return True
     
     # Deactivate connection first
     print(f"[network-config] Deactivating WiFi connection...", flush=True)
-    nmcli_run(["connection", "down", WIFI_CONNECTION_NAME], check=False)
-    time.sleep(1)
+    # nmcli waits for the deactivation to finish before returning; give it
+    # 5 seconds rather than its default of 90
+    nmcli_run(["--wait", "5", "connection", "down", WIFI_CONNECTION_NAME], check=False)
     
     # Delete the connection
     print(f"[network-config] Deleting WiFi connection...", flush=True)
     result = nmcli_run(["connection", "delete", WIFI_CONNECTION_NAME], check=False)
+    forget_connections()
     
     if result.returncode == 0:
         print(f"[network-config] WiFi credentials cleared", flush=True)
@@ -235,18 +218,16 @@ def configure_lan_dhcp(interface="eth0"):
     
     connection_name = f"Wired-{interface}"
     
-    # Check if connection exists
-    result = nmcli_run(["connection", "show", connection_name], check=False)
-    connection_exists = (result.returncode == 0)
-    
-    if connection_exists:
+    if connection_exists(connection_name):
         print(f"[network-config] Updating existing LAN connection '{connection_name}' to use DHCP...", flush=True)
-        # Update existing connection to use DHCP
-        nmcli_run(["connection", "modify", connection_name, "ipv4.method", "auto"], check=False)
-        # Remove static IP settings if they exist
-        nmcli_run(["connection", "modify", connection_name, "ipv4.addresses", ""], check=False)
-        nmcli_run(["connection", "modify", connection_name, "ipv4.gateway", ""], check=False)
-        nmcli_run(["connection", "modify", connection_name, "ipv4.dns", ""], check=False)
+        # Update existing connection to use DHCP, removing any static IP settings
+        nmcli_run([
+            "connection", "modify", connection_name,
+            "ipv4.method", "auto",
+            "ipv4.addresses", "",
+            "ipv4.gateway", "",
+            "ipv4.dns", ""
+        ], check=False)
     else:
         print(f"[network-config] Creating new LAN connection '{connection_name}' with DHCP...", flush=True)
         # Create new connection with DHCP
@@ -258,6 +239,7 @@ def configure_lan_dhcp(interface="eth0"):
             "ipv4.method", "auto",
             "autoconnect", "yes"
         ])
+        forget_connections()
         
         if result.returncode != 0:
             print(f"[network-config] Error creating LAN connection: {result.stderr}", flush=True)
@@ -265,36 +247,18 @@ def configure_lan_dhcp(interface="eth0"):
     
     print(f"[network-config] LAN DHCP configuration updated", flush=True)
     
-    # Activate the connection
+    # Activate the connection; nmcli returns once DHCP has provided an IP
+    # (or has failed), waiting at most 10 seconds
     print("[network-config] Activating LAN connection...", flush=True)
-    result = nmcli_run(["connection", "up", connection_name], check=False)
+    result = nmcli_run(["--wait", "10", "connection", "up", connection_name], check=False,
+                       timeout=10 + NMCLI_TIMEOUT)
     
     if result.returncode != 0:
         print(f"[network-config] Warning: Failed to activate connection: {result.stderr}", flush=True)
         print("[network-config] Connection will be activated automatically when interface is available", flush=True)
     
-    # Wait a moment for DHCP to obtain IP
-    print("[network-config] Waiting for DHCP to obtain IP address...", flush=True)
-    time.sleep(3)
-    
-    # Check if IP was obtained
-    result = subprocess.run(
-        ["ip", "addr", "show", interface],
-        capture_output=True,
-        text=True,
-        check=False
-    )
-    has_ip = False
-    ip_address = None
-    if result.returncode == 0:
-        matches = re.findall(r'inet (\d+\.\d+\.\d+\.\d+)/', result.stdout)
-        for match in matches:
-            if match != "127.0.0.1":
-                has_ip = True
-                ip_address = match
-                break
-    
-    if has_ip:
+    ip_address = get_ipv4_address(interface)
+    if ip_address:
         print(f"[network-config] ✓ DHCP configuration successful!", flush=True)
         print(f"[network-config] IP address: {ip_address}", flush=True)
     else:
@@ -320,35 +284,27 @@ def configure_lan_static(ip, subnet, gateway, dns="8.8.8.8", interface="eth0"):
     # Validate inputs
     if not validate_ip(ip):
         raise ValueError(f"Invalid IP address: {ip}")
-    if not validate_subnet(subnet):
-        raise ValueError(f"Invalid subnet mask: {subnet}")
+    try:
+        cidr = subnet_prefix_length(subnet)
+    except ValueError:
+        raise ValueError(f"Invalid subnet mask: {subnet}") from None
     if not validate_ip(gateway):
         raise ValueError(f"Invalid gateway: {gateway}")
     if not validate_ip(dns):
         raise ValueError(f"Invalid DNS: {dns}")
     
-    # Convert subnet mask to CIDR notation
-    # Simple conversion for common masks
-    subnet_to_cidr = {
-        "255.255.255.0": "24",
-        "255.255.0.0": "16",
-        "255.0.0.0": "8"
-    }
-    cidr = subnet_to_cidr.get(subnet, "24")  # Default to /24
-    
     connection_name = f"Wired-{interface}"
     
-    # Check if connection exists
-    result = nmcli_run(["connection", "show", connection_name], check=False)
-    connection_exists = (result.returncode == 0)
-    
-    if connection_exists:
+    if connection_exists(connection_name):
         print(f"[network-config] Updating existing LAN connection '{connection_name}'...", flush=True)
         # Update existing connection
-        nmcli_run(["connection", "modify", connection_name, "ipv4.method", "manual"], check=False)
-        nmcli_run(["connection", "modify", connection_name, "ipv4.addresses", f"{ip}/{cidr}"], check=False)
-        nmcli_run(["connection", "modify", connection_name, "ipv4.gateway", gateway], check=False)
-        nmcli_run(["connection", "modify", connection_name, "ipv4.dns", dns], check=False)
+        nmcli_run([
+            "connection", "modify", connection_name,
+            "ipv4.method", "manual",
+            "ipv4.addresses", f"{ip}/{cidr}",
+            "ipv4.gateway", gateway,
+            "ipv4.dns", dns
+        ], check=False)
     else:
         print(f"[network-config] Creating new LAN connection '{connection_name}'...", flush=True)
         # Create new connection
@@ -363,6 +319,7 @@ def configure_lan_static(ip, subnet, gateway, dns="8.8.8.8", interface="eth0"):
             "ipv4.dns", dns,
             "autoconnect", "yes"
         ])
+        forget_connections()
         
         if result.returncode != 0:
             print(f"[network-config] Error creating LAN connection: {result.stderr}", flush=True)
@@ -370,9 +327,10 @@ def configure_lan_static(ip, subnet, gateway, dns="8.8.8.8", interface="eth0"):
     
     print(f"[network-config] LAN static IP configuration updated", flush=True)
     
-    # Activate the connection
+    # Activate the connection, waiting at most 10 seconds rather than nmcli's default 90
     print("[network-config] Activating LAN connection...", flush=True)
-    result = nmcli_run(["connection", "up", connection_name], check=False)
+    result = nmcli_run(["--wait", "10", "connection", "up", connection_name], check=False,
+                       timeout=10 + NMCLI_TIMEOUT)
     
     if result.returncode != 0:
         print(f"[network-config] Warning: Failed to activate connection: {result.stderr}", flush=True)
@@ -381,9 +339,20 @@ def configure_lan_static(ip, subnet, gateway, dns="8.8.8.8", interface="eth0"):
     return True
 
 
-def main():
-    """Main entry point."""
-    parser = argparse.ArgumentParser(description="Configure network settings using NetworkManager")
+class UsageError(ValueError):
+    """Bad command-line arguments (what argparse would exit with status 2 for)."""
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """ArgumentParser that raises UsageError on bad arguments instead of exiting."""
+    
+    def error(self, message):
+        raise UsageError(message)
+
+
+def build_parser():
+    """Build the command-line parser shared by main() and apply()."""
+    parser = _ArgumentParser(description="Configure network settings using NetworkManager")
     parser.add_argument("--network-type", choices=["wifi", "lan"], required=False,
                        help="Network type: wifi or lan")
     
@@ -400,45 +369,62 @@ def main():
     parser.add_argument("--gateway", help="Gateway IP address (required if not using --dhcp)")
     parser.add_argument("--dns", default="8.8.8.8", help="DNS server (default: 8.8.8.8, only used with static IP)")
     parser.add_argument("--interface", default="eth0", help="Network interface (default: eth0)")
-    
-    args = parser.parse_args()
-    
-    try:
-        if args.clear_wifi:
-            # Clear WiFi credentials
-            clear_wifi()
-            print("[network-config] WiFi credentials cleared successfully", flush=True)
-            sys.exit(0)
-        elif args.network_type == "wifi":
-            if not args.ssid:
-                print("[network-config] Error: --ssid is required for WiFi", flush=True)
-                sys.exit(1)
-            configure_wifi(args.ssid, args.password)
-            print("[network-config] Configuration applied successfully", flush=True)
-            sys.exit(0)
-        elif args.network_type == "lan":
-            if args.dhcp:
-                # Configure LAN with DHCP
-                configure_lan_dhcp(args.interface)
-                print("[network-config] Configuration applied successfully", flush=True)
-                sys.exit(0)
-            else:
-                # Configure LAN with static IP
-                if not all([args.ip, args.subnet, args.gateway]):
-                    print("[network-config] Error: --ip, --subnet, and --gateway are required for LAN static IP, or use --dhcp", flush=True)
-                    sys.exit(1)
-                configure_lan_static(args.ip, args.subnet, args.gateway, args.dns, args.interface)
-                print("[network-config] Configuration applied successfully", flush=True)
-                sys.exit(0)
+    return parser
+
+
+# Built once at import; config-server.py loads this module and calls apply()
+# for every /configure request
+PARSER = build_parser()
+
+
+def apply(argv):
+    """
+    Apply the configuration described by command-line style arguments
+    (e.g. ["--network-type", "wifi", "--ssid", "home"]).
+    Raises ValueError for missing or invalid arguments, and
+    subprocess.TimeoutExpired if an nmcli call hangs.
+    """
+    args = PARSER.parse_args(argv)
+    
+    if args.clear_wifi:
+        # Clear WiFi credentials
+        clear_wifi()
+        print("[network-config] WiFi credentials cleared successfully", flush=True)
+    elif args.network_type == "wifi":
+        if not args.ssid:
+            raise ValueError("--ssid is required for WiFi")
+        configure_wifi(args.ssid, args.password)
+        print("[network-config] Configuration applied successfully", flush=True)
+    elif args.network_type == "lan":
+        if args.dhcp:
+            # Configure LAN with DHCP
+            configure_lan_dhcp(args.interface)
         else:
-            print("[network-config] Error: --network-type or --clear-wifi is required", flush=True)
-            sys.exit(1)
-    
+            # Configure LAN with static IP
+            if not all([args.ip, args.subnet, args.gateway]):
+                raise ValueError("--ip, --subnet, and --gateway are required for LAN static IP, or use --dhcp")
+            configure_lan_static(args.ip, args.subnet, args.gateway, args.dns, args.interface)
+        print("[network-config] Configuration applied successfully", flush=True)
+    else:
+        raise ValueError("--network-type or --clear-wifi is required")
+
+
+def main():
+    """Main entry point."""
+    try:
+        apply(sys.argv[1:])
+    except UsageError as e:
+        # Same usage message and exit status as a stock ArgumentParser
+        PARSER.print_usage(sys.stderr)
+        PARSER.exit(2, f"{PARSER.prog}: error: {e}\n")
+    except ValueError as e:
+        print(f"[network-config] Error: {e}", flush=True)
+        sys.exit(1)
     except Exception as e:
         print(f"[network-config] Error: {e}", flush=True)
-        import traceback
         print(f"[network-config] Traceback: {traceback.format_exc()}", flush=True)
         sys.exit(1)
+    sys.exit(0)
 
 
 if __name__ == "__main__":
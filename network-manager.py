@@ -6,11 +6,15 @@ Network connectivity detection and WiFi hotspot management for Raspberry Pi.
 - Monitors network status continuously
 """
 import os
+import re
 import sys
 import time
+import select
 import signal
+import shutil
+import socket
 import subprocess
-import ipaddress
+import traceback
 import urllib.request
 import urllib.error
 
@@ -23,39 +27,43 @@ HOTSPOT_PASSWORD = os.environ.get("HOTSPOT_PASSWORD", "bartix-config")
 HOTSPOT_INTERFACE = os.environ.get("HOTSPOT_INTERFACE", "wlan0_ap")
 HOTSPOT_CONNECTION_NAME = "Hotspot"
 
+# nmcli resolved against PATH once, rather than by every exec
+NMCLI = shutil.which("nmcli") or "nmcli"
+
 # Track if regulatory domain has been set (to avoid setting it repeatedly)
 _regulatory_domain_set = False
 
+# rtnetlink multicast group for IPv4 address add/remove notifications
+RTMGRP_IPV4_IFADDR = 0x10
+
+# Transmit power in `iw dev <if> info` output
+TXPOWER_RE = re.compile(r'txpower\s+(\d+(?:\.\d+)?)\s*dBm', re.IGNORECASE)
+
+# country= line in wpa_supplicant.conf
+WPA_COUNTRY_RE = re.compile(r'^\s*country=(\w+)', re.MULTILINE)
+
+# Global regulatory domain in `iw reg get` output ("country NL: DFS-ETSI")
+REG_COUNTRY_RE = re.compile(r'^country (\w+):', re.MULTILINE)
+
 
 def get_active_interfaces():
     """Get list of network interfaces with active IP addresses."""
     interfaces = []
     try:
+        # -o: one line per address ("2: eth0    inet 192.168.1.5/24 brd ..."),
+        # so the interface name is always the second field; parsed as bytes
         result = subprocess.run(
-            ["ip", "-4", "addr", "show"],
+            ["ip", "-o", "-4", "addr", "show"],
             capture_output=True,
-            text=True,
             check=False
         )
-        current_if = None
         for line in result.stdout.splitlines():
-            line = line.strip()
-            if line and not line.startswith("inet "):
-                # Interface name line (e.g., "2: eth0: ...")
-                if ":" in line:
-                    parts = line.split(":", 2)
-                    if len(parts) >= 2:
-                        current_if = parts[1].strip()
-            elif line.startswith("inet "):
-                # IP address line
-                if current_if and current_if != "lo":
-                    ip_part = line.split()[1].split("/")[0]
-                    try:
-                        ipaddress.IPv4Address(ip_part)
-                        if current_if not in interfaces:
-                            interfaces.append(current_if)
-                    except ValueError:
-                        pass
+            fields = line.split(None, 3)
+            if len(fields) < 3 or fields[2] != b"inet":
+                continue
+            name = fields[1].decode("utf-8", "replace")
+            if name != "lo" and name not in interfaces:
+                interfaces.append(name)
     except Exception as e:
         print(f"[network-manager] Error getting interfaces: {e}", flush=True)
     return interfaces
@@ -109,6 +117,47 @@ def has_network_connectivity():
     return (has_ip, has_internet)
 
 
+def open_address_monitor():
+    """
+    Subscribe to kernel IPv4 address change notifications (rtnetlink).
+    
+    Returns:
+        socket: non-blocking netlink socket, or None if netlink is unavailable
+    """
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        return None
+    try:
+        sock.bind((0, RTMGRP_IPV4_IFADDR))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def wait_for_address_event(monitor, timeout):
+    """
+    Sleep up to `timeout` seconds, waking early when an IPv4 address changes.
+    
+    Returns:
+        bool: True if an address change woke us up
+    """
+    if monitor is None:
+        time.sleep(timeout)
+        return False
+    ready, _, _ = select.select([monitor], [], [], timeout)
+    if not ready:
+        return False
+    try:
+        while monitor.recv(65536):
+            pass
+    except BlockingIOError:
+        pass
+    return True
+
+
 def wait_for_network(timeout=NETWORK_WAIT_TIMEOUT, check_internet=True):
     """
     Wait for network connectivity with timeout.
@@ -121,21 +170,28 @@ def wait_for_network(timeout=NETWORK_WAIT_TIMEOUT, check_internet=True):
         tuple: (has_ip, has_internet) - status at end of wait
     """
     start_time = time.time()
-    check_count = 0
-    while time.time() - start_time < timeout:
-        has_ip, has_internet = has_network_connectivity()
-        check_count += 1
-        # Print progress every 5 seconds
-        if check_count % 5 == 0:
-            elapsed = int(time.time() - start_time)
-            print(f"[network-manager] Waiting for network... ({elapsed}s/{timeout}s)", flush=True)
-        
-        if has_ip:
-            if not check_internet or has_internet:
-                elapsed = int(time.time() - start_time)
-                print(f"[network-manager] Network detected after {elapsed}s", flush=True)
-                return (has_ip, has_internet)
-        time.sleep(1)
+    last_progress = start_time
+    # Subscribe before the first check so an address added in between still wakes us
+    monitor = open_address_monitor()
+    try:
+        while time.time() - start_time < timeout:
+            has_ip, has_internet = has_network_connectivity()
+            # Print progress every 5 seconds
+            if time.time() - last_progress >= 5:
+                last_progress = time.time()
+                elapsed = int(last_progress - start_time)
+                print(f"[network-manager] Waiting for network... ({elapsed}s/{timeout}s)", flush=True)
+            
+            if has_ip:
+                if not check_internet or has_internet:
+                    elapsed = int(time.time() - start_time)
+                    print(f"[network-manager] Network detected after {elapsed}s", flush=True)
+                    return (has_ip, has_internet)
+            # Re-check after 1s, or as soon as the kernel reports an address change
+            wait_for_address_event(monitor, 1)
+    finally:
+        if monitor is not None:
+            monitor.close()
     
     # Return final status after timeout
     elapsed = int(time.time() - start_time)
@@ -144,9 +200,59 @@ def wait_for_network(timeout=NETWORK_WAIT_TIMEOUT, check_internet=True):
     return final_status
 
 
+def wait_until(predicate, timeout, interval=0.2):
+    """
+    Call predicate every interval seconds until it returns something true or
+    timeout seconds have passed, and return its last result.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if result or time.monotonic() >= deadline:
+            return result
+        time.sleep(interval)
+
+
+def interface_operstate(interface):
+    """Return the kernel operstate of interface ("up", "down", ...), or None if it doesn't exist."""
+    try:
+        with open(f"/sys/class/net/{interface}/operstate", 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def interface_is_up(interface):
+    """Return whether the kernel reports interface as administratively up (IFF_UP)."""
+    try:
+        with open(f"/sys/class/net/{interface}/flags", 'r') as f:
+            return bool(int(f.read(), 16) & 0x1)
+    except (OSError, ValueError):
+        return False
+
+
+def get_regulatory_domain():
+    """Return the kernel's current regulatory country (e.g. "NL", "00"), or None."""
+    result = subprocess.run(["iw", "reg", "get"], capture_output=True, text=True, check=False)
+    match = REG_COUNTRY_RE.search(result.stdout) if result.returncode == 0 else None
+    return match.group(1) if match else None
+
+
+def get_wifi_country(default="NL"):
+    """Return the WiFi country code from wpa_supplicant.conf, or default."""
+    try:
+        with open("/etc/wpa_supplicant/wpa_supplicant.conf", "r") as f:
+            match = WPA_COUNTRY_RE.search(f.read())
+        if match:
+            return match.group(1).upper()
+    except Exception:
+        pass
+    return default
+
+
 def nmcli_run(cmd, check=True, capture_output=True):
     """Run nmcli command and return result."""
-    full_cmd = ["nmcli"] + cmd
+    full_cmd = [NMCLI] + cmd
     result = subprocess.run(
         full_cmd,
         capture_output=capture_output,
@@ -163,12 +269,7 @@ def nmcli_run(cmd, check=True, capture_output=True):
 def is_hotspot_running():
     """Check if WiFi hotspot is currently running via NetworkManager."""
     try:
-        # Check if NetworkManager connection exists and is active
-        result = nmcli_run(["connection", "show", HOTSPOT_CONNECTION_NAME], check=False)
-        if result.returncode != 0:
-            return False
-        
-        # Check if connection is active
+        # Check if connection is active (fails too when it doesn't exist)
         result = nmcli_run(["connection", "show", "--active", HOTSPOT_CONNECTION_NAME], check=False)
         if result.returncode == 0:
             # Verify interface is actually in AP mode
@@ -210,27 +311,14 @@ def verify_hotspot_broadcasting():
             return False
         
         # Check if interface is UP
-        result = subprocess.run(
-            ["ip", "link", "show", HOTSPOT_INTERFACE],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        if "state UP" not in result.stdout:
+        if interface_operstate(HOTSPOT_INTERFACE) != "up":
             print(f"[network-manager] Interface {HOTSPOT_INTERFACE} is not UP", flush=True)
             return False
         
-        # Check transmit power
-        result = subprocess.run(
-            ["iw", "dev", HOTSPOT_INTERFACE, "info"],
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        if result.returncode == 0 and result.stdout:
+        # Check transmit power (same `iw dev info` output as above)
+        if result.stdout:
             try:
-                import re
-                match = re.search(r'txpower\s+(\d+(?:\.\d+)?)\s*dBm', result.stdout, re.IGNORECASE)
+                match = TXPOWER_RE.search(result.stdout)
                 if match:
                     txpower = float(match.group(1))
                     if txpower < 10:
@@ -241,7 +329,6 @@ def verify_hotspot_broadcasting():
         return True
     except Exception as e:
         print(f"[network-manager] Error verifying hotspot: {e}", flush=True)
-        import traceback
         print(f"[network-manager] Traceback: {traceback.format_exc()}", flush=True)
         return False
 
@@ -265,18 +352,19 @@ def stop_hotspot():
 def start_hotspot():
     """Start WiFi hotspot using NetworkManager."""
     try:
-        # Unblock WiFi if blocked
+        # Unblock WiFi if blocked; nothing before the activation below depends
+        # on it, so let it run while the profile and regulatory domain are checked
         print(f"[network-manager] Unblocking WiFi...", flush=True)
-        subprocess.run(
+        rfkill = subprocess.Popen(
             ["rfkill", "unblock", "wifi"],
-            check=False,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL
         )
-        time.sleep(1)
         
-        # Check if connection already exists
-        result = nmcli_run(["connection", "show", HOTSPOT_CONNECTION_NAME], check=False)
+        # Check if connection already exists, fetching the SSID and password
+        # it has in the same call (-s: include secrets, -e no: unescaped values)
+        result = nmcli_run(["-s", "-e", "no", "-g", "802-11-wireless.ssid,802-11-wireless-security.psk",
+                            "connection", "show", HOTSPOT_CONNECTION_NAME], check=False)
         connection_exists = (result.returncode == 0)
         
         if not connection_exists:
@@ -298,13 +386,16 @@ def start_hotspot():
             
             if result.returncode != 0:
                 print(f"[network-manager] Error creating hotspot connection: {result.stderr}", flush=True)
+                rfkill.wait()
                 return False
             print(f"[network-manager] Hotspot connection created", flush=True)
         else:
-            # Update connection if SSID or password changed
-            print(f"[network-manager] Hotspot connection exists, updating if needed...", flush=True)
-            nmcli_run(["connection", "modify", HOTSPOT_CONNECTION_NAME, "ssid", HOTSPOT_SSID], check=False)
-            nmcli_run(["connection", "modify", HOTSPOT_CONNECTION_NAME, "wifi-sec.psk", HOTSPOT_PASSWORD], check=False)
+            # Update connection only if SSID or password changed; a modify
+            # rewrites the profile on disk even when nothing differs
+            if result.stdout.splitlines() != [HOTSPOT_SSID, HOTSPOT_PASSWORD]:
+                print(f"[network-manager] Hotspot connection exists, updating SSID/password...", flush=True)
+                nmcli_run(["connection", "modify", HOTSPOT_CONNECTION_NAME,
+                           "ssid", HOTSPOT_SSID, "wifi-sec.psk", HOTSPOT_PASSWORD], check=False)
         
         # Set regulatory domain if needed (only once)
         global _regulatory_domain_set
@@ -316,20 +407,7 @@ def start_hotspot():
                 check=False
             )
             if reg_result.returncode == 0 and ("country 99" in reg_result.stdout or "DFS-UNSET" in reg_result.stdout):
-                country_code = "NL"  # default
-                try:
-                    # Try to get country from NetworkManager or system
-                    nm_result = nmcli_run(["general", "permissions"], check=False)
-                    # Or check /etc/default/crda or similar
-                    if os.path.exists("/etc/wpa_supplicant/wpa_supplicant.conf"):
-                        with open("/etc/wpa_supplicant/wpa_supplicant.conf", "r") as f:
-                            for line in f:
-                                if line.strip().startswith("country="):
-                                    country_code = line.split("=")[1].strip().upper()
-                                    break
-                except Exception:
-                    pass
-                
+                country_code = get_wifi_country()
                 print(f"[network-manager] Setting WiFi country code to {country_code}...", flush=True)
                 subprocess.run(
                     ["iw", "reg", "set", country_code],
@@ -337,10 +415,13 @@ def start_hotspot():
                     stdout=subprocess.DEVNULL,
                     stderr=subprocess.DEVNULL
                 )
+                # The kernel applies the new domain asynchronously; wait for it
+                # (at most 2 s) so AP channels aren't picked under the old one
+                wait_until(lambda: get_regulatory_domain() == country_code, timeout=2)
                 _regulatory_domain_set = True
-                time.sleep(1)
         
-        # Activate the hotspot connection
+        # Activate the hotspot connection (once WiFi is unblocked)
+        rfkill.wait()
         print(f"[network-manager] Activating hotspot connection...", flush=True)
         result = nmcli_run(["connection", "up", HOTSPOT_CONNECTION_NAME])
         
@@ -348,8 +429,8 @@ def start_hotspot():
             print(f"[network-manager] Error activating hotspot: {result.stderr}", flush=True)
             return False
         
-        # Wait a bit for connection to establish
-        time.sleep(3)
+        # Wait for the AP interface to come up rather than a fixed delay
+        wait_until(lambda: interface_operstate(HOTSPOT_INTERFACE) == "up", timeout=5)
         
         # Verify hotspot is broadcasting
         print(f"[network-manager] Verifying hotspot is broadcasting...", flush=True)
@@ -364,8 +445,7 @@ def start_hotspot():
                 check=False
             )
             if result.returncode == 0 and result.stdout:
-                import re
-                match = re.search(r'txpower\s+(\d+(?:\.\d+)?)\s*dBm', result.stdout, re.IGNORECASE)
+                match = TXPOWER_RE.search(result.stdout)
                 if match:
                     txpower = match.group(1)
                     print(f"[network-manager] Transmit power: {txpower} dBm", flush=True)
@@ -377,7 +457,6 @@ def start_hotspot():
             
     except Exception as e:
         print(f"[network-manager] Error starting hotspot: {e}", flush=True)
-        import traceback
         print(f"[network-manager] Traceback: {traceback.format_exc()}", flush=True)
         return False
 
@@ -411,8 +490,6 @@ def ensure_hotspot_config():
 
 def main_loop():
     """Main loop: monitor network and manage hotspot."""
-    import signal
-    
     stop_flag = False
     
     def signal_handler(sig, frame):
@@ -439,25 +516,10 @@ def main_loop():
     # Wait for physical WiFi interface (wlan0) to be available
     print("[network-manager] Waiting for physical WiFi interface (wlan0) to be available...", flush=True)
     interface_wait_timeout = 30
-    wlan0_available = False
-    for i in range(interface_wait_timeout):
-        try:
-            result = subprocess.run(
-                ["ip", "link", "show", "wlan0"],
-                capture_output=True,
-                text=True,
-                check=False
-            )
-            if result.returncode == 0:
-                wlan0_available = True
-                print(f"[network-manager] Physical WiFi interface wlan0 is available", flush=True)
-                break
-        except Exception:
-            pass
-        if i < interface_wait_timeout - 1:
-            time.sleep(1)
-    
-    if not wlan0_available:
+    wlan0_available = wait_until(lambda: interface_operstate("wlan0") is not None, interface_wait_timeout, interval=0.5)
+    if wlan0_available:
+        print(f"[network-manager] Physical WiFi interface wlan0 is available", flush=True)
+    else:
         print(f"[network-manager] Warning: Physical WiFi interface wlan0 not found after {interface_wait_timeout}s", flush=True)
         print("[network-manager] Will continue and retry in monitor loop", flush=True)
     
@@ -471,17 +533,7 @@ def main_loop():
         )
         if result.returncode == 0:
             if "country 99" in result.stdout or "DFS-UNSET" in result.stdout:
-                country_code = "NL"  # default
-                try:
-                    if os.path.exists("/etc/wpa_supplicant/wpa_supplicant.conf"):
-                        with open("/etc/wpa_supplicant/wpa_supplicant.conf", "r") as f:
-                            for line in f:
-                                if line.strip().startswith("country="):
-                                    country_code = line.split("=")[1].strip().upper()
-                                    break
-                except Exception:
-                    pass
-                
+                country_code = get_wifi_country()
                 print(f"[network-manager] Setting WiFi country code to {country_code}...", flush=True)
                 subprocess.run(
                     ["iw", "reg", "set", country_code],
@@ -489,9 +541,11 @@ def main_loop():
                     stdout=subprocess.DEVNULL,
                     stderr=subprocess.DEVNULL
                 )
+                # The kernel applies the new domain asynchronously; wait for it
+                # (at most 2 s) so AP channels aren't picked under the old one
+                wait_until(lambda: get_regulatory_domain() == country_code, timeout=2)
                 global _regulatory_domain_set
                 _regulatory_domain_set = True
-                time.sleep(2)
     except Exception as e:
         print(f"[network-manager] Warning: Could not set country code: {e}", flush=True)
     
@@ -499,9 +553,11 @@ def main_loop():
     print("[network-manager] Checking network connectivity...", flush=True)
     has_ip, has_internet = wait_for_network(timeout=NETWORK_WAIT_TIMEOUT, check_internet=False)
     
-    # Wait a bit more for system to fully settle after boot
-    print("[network-manager] Waiting for system to settle...", flush=True)
-    time.sleep(3)
+    # NetworkManager brings wlan0 up once it has taken the device over; give
+    # it up to 3 s (the old fixed settle delay) before creating the AP on it
+    if wlan0_available and not interface_is_up("wlan0"):
+        print("[network-manager] Waiting for wlan0 to come up...", flush=True)
+        wait_until(lambda: interface_is_up("wlan0"), timeout=3)
     
     # Always start hotspot (as per requirement: always available)
     print("[network-manager] Ensuring hotspot is started...", flush=True)
@@ -517,7 +573,6 @@ def main_loop():
         if ensure_hotspot_config():
             if start_hotspot():
                 # Verify it's actually broadcasting
-                time.sleep(2)
                 if verify_hotspot_broadcasting():
                     hotspot_started = True
                     break
@@ -558,7 +613,7 @@ def main_loop():
                         # Connection is active but not broadcasting - try reactivating
                         print("[network-manager] Hotspot connection active but not broadcasting, reactivating...", flush=True)
                         stop_hotspot()
-                        time.sleep(2)
+                        wait_until(lambda: interface_operstate(HOTSPOT_INTERFACE) != "up", timeout=2)
                         start_hotspot()
                 
                 last_check = now
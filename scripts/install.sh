@@ -33,7 +33,7 @@ fi
 #Packages
 
 sudo apt-get update
-sudo apt-get install -y python3 mpv ca-certificates alsa-utils network-manager iw wireless-tools rfkill
+sudo apt-get install -y python3 python3-alsaaudio mpv ca-certificates alsa-utils network-manager iw wireless-tools rfkill
 
 #Copy files
 
@@ -74,6 +74,8 @@ HOTSPOT_PASSWORD="bartix-${UNIQUE_ID}"
 sudo sed -i "s|Environment=HOTSPOT_SSID=.*|Environment=HOTSPOT_SSID=${HOTSPOT_SSID}|" /etc/systemd/system/network-manager.service
 sudo sed -i "s|Environment=HOTSPOT_PASSWORD=.*|Environment=HOTSPOT_PASSWORD=${HOTSPOT_PASSWORD}|" /etc/systemd/system/network-manager.service
 sudo sed -i "s|Environment=HOTSPOT_INTERFACE=.*|Environment=HOTSPOT_INTERFACE=wlan0_ap|" /etc/systemd/system/network-manager.service
+# Drop-ins written by the web UI would override the values above
+sudo rm -f /etc/systemd/system/network-manager.service.d/hotspot-ssid.conf /etc/systemd/system/network-manager.service.d/hotspot-password.conf
 
 # Disable conflicting network services (NetworkManager will handle everything)
 echo "Disabling conflicting network services..."
@@ -173,6 +175,7 @@ fi
 # Replace service placeholders with actual values
 sudo sed -i "s#^User=.*#User=${USER_NAME}#" /etc/systemd/system/stream-player.service
 sudo sed -i "s#^Environment=STREAM_MANIFEST_URL=.*#Environment=STREAM_MANIFEST_URL=${MANIFEST_URL}#" /etc/systemd/system/stream-player.service
+sudo rm -f /etc/systemd/system/stream-player.service.d/manifest.conf
 sudo sed -i "s#^Environment=MPV_AUDIO_DEVICE=.*#Environment=MPV_AUDIO_DEVICE=${DEVICE}#" /etc/systemd/system/stream-player.service
 
 # Ensure audio access
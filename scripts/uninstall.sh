@@ -55,6 +55,12 @@ echo "Removing systemd service files..."
 sudo rm -f /etc/systemd/system/stream-player.service
 sudo rm -f /etc/systemd/system/network-manager.service
 sudo rm -f /etc/systemd/system/config-server.service
+
+# Remove the drop-ins written by the web UI (the hotspot password one holds
+# the password in plain text); rmdir only succeeds if no other overrides remain
+sudo rm -f /etc/systemd/system/stream-player.service.d/manifest.conf
+sudo rm -f /etc/systemd/system/network-manager.service.d/hotspot-ssid.conf /etc/systemd/system/network-manager.service.d/hotspot-password.conf
+sudo rmdir /etc/systemd/system/stream-player.service.d /etc/systemd/system/network-manager.service.d 2>/dev/null || true
 sudo systemctl daemon-reload
 
 # Remove installed scripts